@@ -1,8 +1,28 @@
 from django.contrib import admin
 from backend.models import *
+from backend.streaming import StreamingJsonResponse, iter_lovers
+
+
+def export_json(modeladmin, request, queryset):
+    response = StreamingJsonResponse(iter_lovers(queryset.order_by('id')))
+    response['Content-Disposition'] = 'attachment; filename="lovers.json"'
+    return response
+
+
+export_json.short_description = 'Exporter en JSON'
+
+
+class LoverAdmin(admin.ModelAdmin):
+    actions = [export_json]
+    list_display = 'name', 'city', 'like_count', 'dislike_count', 'match_count'
+    list_select_related = 'city',
+    # kept by backend.swipes and the reconcile_counters command
+    readonly_fields = 'like_count', 'dislike_count', 'match_count'
+
 
 # Register your models here.
 admin.site.register(City)
 admin.site.register(Gender)
-admin.site.register(Lover)
+admin.site.register(Lover, LoverAdmin)
 admin.site.register(Photo)
+admin.site.register(Match)
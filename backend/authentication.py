@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def _dump(instance):
+    fields = tuple(f.attname for f in instance._meta.concrete_fields)
+    return instance._state.db, fields, tuple(getattr(instance, f) for f in fields)
+
+
+def _load(model, dump):
+    db, fields, values = dump
+    return model.from_db(db, fields, values)
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of token key -> (user, token), with a time to live.
+
+    Only field values are kept so that every request gets its own model
+    instances. Entries are invalidated by the signals of ``backend.signals``
+    when a token is deleted or a user is changed; the TTL bounds how long
+    another worker process may keep a revoked token.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user_id, user, token = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return _load(User, user), _load(Token, token)
+
+    def set(self, key, user: User, token: Token):
+        if self.max_size <= 0:
+            return
+        entry = (time.monotonic() + self.ttl, user.id, _dump(user), _dump(token))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[1] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication resolving the token through ``token_cache``."""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
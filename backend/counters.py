@@ -0,0 +1,33 @@
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from backend.models import Lover, Match, PendingSwipe
+
+
+def _count(queryset, column, distinct=None):
+    # correlated COUNT of the rows of queryset pointing to the updated lover
+    count = Count(distinct, distinct=True) if distinct else Count('*')
+    return Coalesce(Subquery(queryset.filter(**{column: OuterRef('pk')}).order_by().values(column)
+                             .annotate(count=count).values('count'), output_field=IntegerField()), Value(0))
+
+
+def _pending(PendingSwipe, through, liked):
+    # buffered swipes not flushed yet, a swipe is in both tables until its flush commits
+    return PendingSwipe.objects.annotate(
+        flushed=Exists(through.objects.filter(from_lover=OuterRef('lover'), to_lover=OuterRef('target'))),
+    ).filter(liked=liked, flushed=False)
+
+
+def reconcile():
+    """
+    Recompute the like, dislike and match counters of every lover with one
+    UPDATE. Buffered swipes are counted like the flushed ones, once per
+    swiping lover. Return the number of lovers updated.
+    """
+    return Lover.objects.update(
+        like_count=_count(Lover.likes.through.objects.all(), 'to_lover')
+        + _count(_pending(PendingSwipe, Lover.likes.through, True), 'target', 'lover'),
+        dislike_count=_count(Lover.dislikes.through.objects.all(), 'to_lover')
+        + _count(_pending(PendingSwipe, Lover.dislikes.through, False), 'target', 'lover'),
+        match_count=_count(Match.objects.all(), 'lover'),
+    )
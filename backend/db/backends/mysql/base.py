@@ -0,0 +1,16 @@
+from django.db.backends.mysql import base
+
+from backend.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+
+    def is_reusable(self, connection):
+        return bool(connection.open)
+
+    def ping(self, connection):
+        try:
+            connection.ping()
+        except base.Database.Error:
+            return False
+        return True
@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db.utils import OperationalError
+
+from backend.metrics import registry
+
+
+class ConnectionPool:
+    """
+    Driver connections shared by the threads of a worker.
+
+    At most ``max_size`` connections are open at once, idle or checked out. A
+    checkout reuses the most recently returned idle connection that
+    ``is_reusable`` accepts, opens a new one while below ``max_size``, and
+    otherwise waits up to ``timeout`` seconds for one to be returned. A
+    connection idle for ``ping_idle`` seconds or more is only reused when
+    ``ping`` succeeds on it, 0 pings at every checkout.
+    """
+
+    def __init__(self, alias, max_size, timeout, ping_idle=0):
+        self.alias = alias
+        self.timeout = timeout
+        self.ping_idle = ping_idle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def checkout(self, connect, is_reusable=lambda connection: True, ping=lambda connection: True):
+        registry.count_connection(self.alias, 'checkout')
+        if not self._slots.acquire(blocking=False):
+            registry.count_connection(self.alias, 'wait')
+            if not self._slots.acquire(timeout=self.timeout):
+                raise OperationalError('No connection to %s was returned within %ss' % (self.alias, self.timeout))
+        try:
+            while True:
+                try:
+                    returned, connection = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if is_reusable(connection) and (time.monotonic() - returned < self.ping_idle or ping(connection)):
+                    return connection
+                self._close(connection)
+            registry.count_connection(self.alias, 'reconnect')
+            return connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, connection, reusable=True):
+        if reusable:
+            self._idle.put((time.monotonic(), connection))
+        else:
+            self._close(connection)
+        self._slots.release()
+
+    def _close(self, connection):
+        registry.count_connection(self.alias, 'discard')
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def clear(self):
+        """Close the idle connections, the checked out ones are closed when returned."""
+        while True:
+            try:
+                returned, connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias) -> ConnectionPool:
+    with _pools_lock:
+        if alias not in _pools:
+            ping_idle = 0 if settings.DB_HEALTH_CHECKS else settings.DB_POOL_PING_IDLE
+            _pools[alias] = ConnectionPool(alias, settings.DB_POOL_SIZE, settings.DB_POOL_TIMEOUT, ping_idle)
+        return _pools[alias]
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Database wrapper taking its connections from the pool of its alias and
+    returning them on close() instead of closing them. Connections closed
+    inside a transaction or after a database error are discarded.
+    """
+    pooled = True
+
+    def is_reusable(self, connection):
+        return True
+
+    def ping(self, connection):
+        """Whether a round trip to the server on the idle driver ``connection`` succeeds."""
+        return True
+
+    def get_new_connection(self, conn_params):
+        return get_pool(self.alias).checkout(lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(
+            conn_params), self.is_reusable, self.ping)
+
+    def _close(self):
+        if self.connection is None:
+            return
+        reusable = not self.in_atomic_block and not self.errors_occurred
+        if reusable and not self.autocommit:
+            try:
+                self.connection.rollback()
+            except Exception:
+                reusable = False
+        get_pool(self.alias).checkin(self.connection, reusable and self.is_reusable(self.connection))
@@ -0,0 +1,189 @@
+import abc
+import asyncio
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('backend.events')
+
+
+class Broker(abc.ABC):
+    """
+    Publish/subscribe interface of the match events, keyed by lover id.
+
+    ``subscribe`` and ``unsubscribe`` are called from the event loop serving
+    the stream; ``publish`` may be called from any thread. Another broker can
+    be used by setting MATCH_EVENTS_BROKER to its dotted path.
+    """
+
+    @abc.abstractmethod
+    def subscribe(self, lover_id):
+        """Return an asyncio.Queue receiving the events of ``lover_id``."""
+
+    @abc.abstractmethod
+    def unsubscribe(self, lover_id, queue):
+        pass
+
+    @abc.abstractmethod
+    def publish(self, lover_id, event: dict):
+        pass
+
+
+class InProcessBroker(Broker):
+    """
+    Deliver the events published in this process to the streams served by
+    this process. Every subscriber has a bounded queue, the events of a client
+    that does not read them are dropped rather than buffered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, lover_id):
+        queue = asyncio.Queue(maxsize=settings.MATCH_STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(lover_id, set()).add((asyncio.get_event_loop(), queue))
+        return queue
+
+    def unsubscribe(self, lover_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(lover_id, set())
+            subscribers.difference_update({x for x in subscribers if x[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(lover_id, None)
+
+    def publish(self, lover_id, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(lover_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue, event):
+        if not queue.full():
+            queue.put_nowait(event)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(x) for x in self._subscribers.values())
+
+
+class UnixSocketBroker(Broker):
+    """
+    Deliver the events to the streams served by every process of this host,
+    whichever process publishes them: the API may run under gunicorn and the
+    streams under several ASGI workers.
+
+    A process serving streams binds a datagram socket named after its pid in
+    MATCH_EVENTS_SOCKET_DIR on its first subscription, and ``publish`` sends
+    the event to every socket of the directory. The sockets of processes that
+    are gone are removed, and an event is dropped for a process whose socket
+    buffer is full, like InProcessBroker drops it for a full queue.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.MATCH_EVENTS_SOCKET_DIR
+        self._local = InProcessBroker()
+        self._lock = threading.Lock()
+        self._socket = None
+        self._loop = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '%d.sock' % os.getpid())
+
+    def _listen(self):
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            if self._socket is None:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+                receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                receiver.setblocking(False)
+                # left by a previous process with the same pid
+                self._unlink(self.path)
+                receiver.bind(self.path)
+                atexit.register(self.close)
+                self._socket = receiver
+            if self._loop is None or self._loop.is_closed():
+                loop.add_reader(self._socket.fileno(), self._receive)
+                self._loop = loop
+
+    def _receive(self):
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                return
+            message = json.loads(data.decode())
+            self._local.publish(message['lover'], message['event'])
+
+    def subscribe(self, lover_id):
+        self._listen()
+        return self._local.subscribe(lover_id)
+
+    def unsubscribe(self, lover_id, queue):
+        self._local.unsubscribe(lover_id, queue)
+
+    def publish(self, lover_id, event: dict):
+        data = json.dumps({'lover': lover_id, 'event': event}).encode()
+        try:
+            names = [x for x in os.listdir(self.directory) if x.endswith('.sock')]
+        except FileNotFoundError:
+            # no process serves streams yet
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    self._unlink(path)
+                except BlockingIOError:
+                    logger.warning('Dropped a match event for %s, its stream process does not read them', path)
+
+    def subscriber_count(self):
+        return self._local.subscriber_count()
+
+    def close(self):
+        with self._lock:
+            if self._socket is None:
+                return
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._unlink(self.path)
+            self._socket = self._loop = None
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Broker:
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.MATCH_EVENTS_BROKER)()
+        return _broker
+
+
+def publish_match(lover_id, matched_id):
+    """Tell both lovers about their match."""
+    broker = get_broker()
+    broker.publish(lover_id, {'type': 'match', 'lover': matched_id})
+    broker.publish(matched_id, {'type': 'match', 'lover': lover_id})
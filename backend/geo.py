@@ -0,0 +1,101 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from backend.models import City
+
+EARTH_RADIUS = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle distance in kilometers."""
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((latitude2 - latitude1) / 2) ** 2 + \
+        math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class CityIndex:
+    """
+    Process-local grid of the cities with coordinates, answering which cities
+    are within a radius of another one.
+
+    Cities are put in cells of ``cell_degrees`` degrees, so a radius query only
+    measures the distance to the cities of the few cells the radius covers.
+    Answers are memoized per (city, radius) since lovers of the same city
+    mostly share a handful of radii. The grid is rebuilt when a city is saved,
+    see ``backend.signals``, and every ``ttl`` seconds for the cities saved by
+    other worker processes.
+    """
+
+    def __init__(self, cell_degrees, ttl=None):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._cities = {}
+        self._cells = {}
+        self._nearby = {}
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._cities, self._cells, self._nearby = {}, {}, {}
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is not None and (self.ttl is None or time.monotonic() - self._loaded_at < self.ttl):
+                return
+        cities, cells = {}, {}
+        rows = City.objects.filter(latitude__isnull=False, longitude__isnull=False) \
+            .values_list('id', 'latitude', 'longitude')
+        for city_id, latitude, longitude in rows:
+            cities[city_id] = (latitude, longitude)
+            cells.setdefault(self.cell(latitude, longitude), []).append(city_id)
+        with self._lock:
+            self._cities, self._cells, self._nearby = cities, cells, {}
+            self._loaded_at = time.monotonic()
+
+    def cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def nearby(self, city_id, radius):
+        """Return the ids of the cities within ``radius`` kilometers of ``city_id``, itself included."""
+        if not radius or city_id is None:
+            return frozenset((city_id,))
+        self.ensure_loaded()
+        with self._lock:
+            cached = self._nearby.get((city_id, radius))
+            if cached is not None:
+                return cached
+            origin = self._cities.get(city_id)
+            if origin is None:
+                return frozenset((city_id,))
+            latitude, longitude = origin
+            latitude_delta = radius / KM_PER_DEGREE
+            # meridians get closer towards the poles, where any longitude may be within the radius
+            if abs(latitude) + latitude_delta >= 90:
+                longitude_delta = 180.0
+            else:
+                cos_latitude = math.cos(math.radians(abs(latitude) + latitude_delta))
+                longitude_delta = min(180.0, radius / (KM_PER_DEGREE * cos_latitude))
+            (row_min, column_min) = self.cell(latitude - latitude_delta, longitude - longitude_delta)
+            (row_max, column_max) = self.cell(latitude + latitude_delta, longitude + longitude_delta)
+            columns = int(round(360 / self.cell_degrees))
+            result = {city_id}
+            for row in range(row_min, row_max + 1):
+                for column in range(column_min, min(column_max, column_min + columns - 1) + 1):
+                    # wrap around the antimeridian
+                    column = (column + columns // 2) % columns - columns // 2
+                    for other_id in self._cells.get((row, column), ()):
+                        if distance(latitude, longitude, *self._cities[other_id]) <= radius:
+                            result.add(other_id)
+            result = frozenset(result)
+            self._nearby[(city_id, radius)] = result
+            return result
+
+
+city_index = CityIndex(settings.CITY_GRID_DEGREES, ttl=settings.REFERENCE_CACHE_TTL)
@@ -0,0 +1,66 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from backend.models import Photo
+
+# name of the Photo field -> largest side in pixels
+PHOTO_SIZES = (
+    ('thumbnail', 200),
+    ('card', 640),
+    ('full', 1600),
+)
+
+
+def _encode(image: Image.Image):
+    if settings.PHOTO_WEBP:
+        output, extension = BytesIO(), 'webp'
+        image.save(output, 'WEBP', quality=settings.PHOTO_QUALITY, method=4)
+    else:
+        output, extension = BytesIO(), 'jpg'
+        image.save(output, 'JPEG', quality=settings.PHOTO_QUALITY, optimize=True, progressive=True)
+    return output.getvalue(), extension
+
+
+def open_image(field_file) -> Image.Image:
+    """Decode ``field_file``, applying its EXIF orientation. Raise OSError when it is not an image."""
+    field_file.open('rb')
+    try:
+        with Image.open(field_file) as image:
+            return ImageOps.exif_transpose(image).convert('RGB')
+    finally:
+        field_file.close()
+
+
+def generate_derivatives(photo: Photo, original: Image.Image = None):
+    """
+    Create the resized versions of ``photo.image`` listed in PHOTO_SIZES and
+    save them on the photo. Smaller images are never enlarged.
+    """
+    if original is None:
+        original = open_image(photo.image)
+    stem = os.path.splitext(os.path.basename(photo.image.name))[0]
+    for field, size in PHOTO_SIZES:
+        resized = original.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        content, extension = _encode(resized)
+        getattr(photo, field).save('%s_%s.%s' % (stem, field, extension), ContentFile(content), save=False)
+    photo.save(update_fields=[field for field, size in PHOTO_SIZES])
+
+
+def process_upload(photo: Photo):
+    """
+    Turn the staged upload of ``photo`` into its stored original: the image is
+    decoded and re-encoded, which drops its EXIF metadata, then resized.
+    The caller saves ``photo.image``.
+    """
+    original = open_image(photo.image)
+    staged_name = photo.image.name
+    content, extension = _encode(original)
+    stem = os.path.splitext(os.path.basename(staged_name))[0]
+    photo.image.save('%s.%s' % (stem, extension), ContentFile(content), save=False)
+    photo.image.storage.delete(staged_name)
+    generate_derivatives(photo, original)
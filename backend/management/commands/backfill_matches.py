@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, F, OuterRef
+
+from backend.counters import reconcile
+from backend.models import Lover, Match
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Create the missing Match rows from the mutual likes'
+
+    def handle(self, *args, **options):
+        like = Lover.likes.through
+        mutual_likes = like.objects.annotate(
+            mutual=Exists(like.objects.filter(from_lover=OuterRef('to_lover'), to_lover=OuterRef('from_lover')))
+        ).filter(mutual=True).exclude(from_lover=F('to_lover')).values_list('from_lover_id', 'to_lover_id')
+        before = Match.objects.count()
+        batch = []
+        # every mutual like is seen from both sides, each side creates its own row
+        for lover_id, matched_id in mutual_likes.iterator():
+            batch.append(Match(lover_id=lover_id, matched_id=matched_id))
+            if len(batch) >= BATCH_SIZE:
+                Match.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        Match.objects.bulk_create(batch, ignore_conflicts=True)
+        created = Match.objects.count() - before
+        if created:
+            reconcile()
+        self.stdout.write(self.style.SUCCESS('%d matches created' % created))
@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from backend.matching import candidate_queryset
+from backend.models import Lover
+
+
+class Command(BaseCommand):
+    help = 'Measure the latency of the candidate query as the swipe history of a lover grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lover', type=int, default=None, help='Id of the lover to benchmark')
+        parser.add_argument('--sizes', default='0,100,1000,10000', help='Comma separated swipe history sizes')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed queries per size')
+
+    def handle(self, *args, **options):
+        lovers = Lover.objects.exclude(age_min=None).exclude(age_max=None)
+        lover = lovers.filter(id=options['lover']).first() if options['lover'] else lovers.first()
+        if lover is None:
+            raise CommandError('No lover to benchmark, seed the database first')
+        sizes = sorted(int(x) for x in options['sizes'].split(','))
+        limit = settings.DECK_PAGE_SIZE
+
+        # the swiped lovers are never candidates so the result size stays the same
+        candidate_ids = set(candidate_queryset(lover).values_list('id', flat=True))
+        swipeable = list(Lover.objects.exclude(id__in=candidate_ids).exclude(id=lover.id)
+                         .values_list('id', flat=True)[:sizes[-1]])
+        self.stdout.write('lover %s, %d candidates, %d lovers available to swipe' % (
+            lover.id, len(candidate_ids), len(swipeable)))
+
+        with transaction.atomic():
+            history = 0
+            for size in sizes:
+                size = min(size, len(swipeable))
+                new_swipes = swipeable[history:size]
+                half = len(new_swipes) // 2
+                lover.likes.through.objects.bulk_create([
+                    lover.likes.through(from_lover_id=lover.id, to_lover_id=x) for x in new_swipes[:half]
+                ])
+                lover.dislikes.through.objects.bulk_create([
+                    lover.dislikes.through(from_lover_id=lover.id, to_lover_id=x) for x in new_swipes[half:]
+                ])
+                history = size
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    # the query itself, the deck and the index would only time a lookup
+                    list(candidate_queryset(lover).order_by('id').values_list('id', flat=True)[:limit + 1])
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write('history %6d: p50 %7.2f ms, max %7.2f ms' % (
+                    history, statistics.median(timings), max(timings)))
+            transaction.set_rollback(True)
@@ -0,0 +1,47 @@
+import random
+import statistics
+import time
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend import ranking
+from backend.models import Lover
+
+
+class Command(BaseCommand):
+    help = 'Compare the NumPy and the pure Python scoring of candidates on synthetic candidate sets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000', help='Comma separated numbers of candidates')
+        parser.add_argument('--repeat', type=int, default=10, help='Number of timed rankings per size')
+        parser.add_argument('--limit', type=int, default=20, help='Size of the page kept after ranking')
+
+    def handle(self, *args, **options):
+        if ranking.numpy is None:
+            raise CommandError('NumPy is not installed')
+        rng = random.Random(0)
+        today = datetime.today()
+        lover = Lover(birth_date=date(today.year - 30, 1, 1), age_min=25, age_max=38)
+        for size in sorted(int(x) for x in options['sizes'].split(',')):
+            features = {'id': list(range(1, size + 1)), 'age': [], 'age_min': [], 'age_max': [], 'days': [],
+                        'likes': []}
+            for _ in range(size):
+                age_min = rng.randint(18, 40)
+                features['age'].append(rng.randint(25, 38))
+                features['age_min'].append(age_min)
+                features['age_max'].append(age_min + rng.randint(5, 25))
+                features['days'].append(rng.randint(0, 1000))
+                features['likes'].append(int(rng.expovariate(1 / 20)))
+            results = {}
+            for name, score in (('python', ranking.score_python), ('numpy', ranking.score_numpy)):
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    results[name] = ranking.rank(features['id'], score(lover, features, today),
+                                                 limit=options['limit'])
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write('%6d candidates, %-6s: p50 %8.2f ms, max %8.2f ms' % (
+                    size, name, statistics.median(timings), max(timings)))
+            if results['python'][0] != results['numpy'][0]:
+                self.stdout.write(self.style.WARNING('%d candidates: the rankings differ' % size))
@@ -0,0 +1,106 @@
+import json
+import random
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from backend import matching
+from backend.authentication import token_cache
+from backend.models import City, Gender, Lover
+
+ENDPOINTS = ('candidates', 'matches', 'like', 'my_profile', 'register')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API endpoints on a throwaway database seeded at several sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000', help='Comma separated numbers of lovers')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint and size')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma separated endpoints among %s' % ', '.join(ENDPOINTS))
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'].split(',')
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError('Unknown endpoints: %s' % ', '.join(sorted(unknown)))
+        sizes = [int(x) for x in options['sizes'].split(',')]
+
+        # never write to the configured database, the test database is created and dropped
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write('%-11s %7s %8s %9s %9s %9s %7s %6s' % (
+                'endpoint', 'lovers', 'requests', 'p50 ms', 'p95 ms', 'req/s', 'queries', 'errors'))
+            for size in sizes:
+                call_command('flush', interactive=False, verbosity=0)
+                call_command('seed', lovers=size, cities=max(1, size // 500), stdout=StringIO())
+                matching.index.clear()
+                matching.decks.clear()
+                token_cache.clear()
+                for endpoint in endpoints:
+                    self.benchmark(endpoint, size, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, endpoint, size, requests):
+        rng = random.Random(size)
+        lover_ids = list(Lover.objects.values_list('id', flat=True))
+        sample = rng.sample(lover_ids, min(requests, len(lover_ids)))
+        clients = []
+        for lover in Lover.objects.filter(id__in=sample).select_related('user'):
+            token, created = Token.objects.get_or_create(user=lover.user)
+            clients.append((lover, Client(HTTP_AUTHORIZATION='Token %s' % token.key)))
+        gender = Gender.objects.first()
+        city = City.objects.first()
+
+        timings, queries, errors = [], [], 0
+        # the first request of every client warms the caches and is not timed
+        for i in range(-len(clients), requests):
+            lover, client = clients[i % len(clients)]
+            if endpoint == 'candidates':
+                request = lambda: client.get('/api/lovers/candidates')
+            elif endpoint == 'matches':
+                request = lambda: client.get('/api/matches')
+            elif endpoint == 'my_profile':
+                request = lambda: client.get('/api/lovers/me')
+            elif endpoint == 'like':
+                request = lambda: client.post('/api/lovers/%d/like' % rng.choice(lover_ids))
+            else:
+                body = json.dumps({
+                    'username': 'bench_%d_%d' % (size, i + len(clients)),
+                    'email': 'bench_%d_%d@lovocco.test' % (size, i + len(clients)),
+                    'name': 'Bench',
+                    'password': 'lovocco-bench',
+                    'gender': gender.id,
+                    'city': city.id,
+                    'birthdate': '1990-05-17',
+                })
+                request = lambda: client.post('/api/register', body, content_type='application/json')
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - start
+            if i < 0:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(len(context.captured_queries))
+            errors += response.status_code >= 400
+
+        self.stdout.write('%-11s %7d %8d %9.2f %9.2f %9.1f %7.1f %6d' % (
+            endpoint, size, requests, percentile(timings, 0.5), percentile(timings, 0.95),
+            1000 * len(timings) / sum(timings), sum(queries) / len(queries), errors))
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from backend.matching import MatchingIndex, candidate_queryset
+from backend.models import Lover
+
+
+class Command(BaseCommand):
+    help = 'Compare the candidates returned by the matching index with the ORM query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Only check the first LIMIT lovers')
+
+    def handle(self, *args, **options):
+        today = datetime.today()
+        index = MatchingIndex()
+        index.load()
+        lovers = Lover.objects.select_related('user').order_by('id')
+        if options['limit']:
+            lovers = lovers[:options['limit']]
+        checked = mismatches = 0
+        for lover in lovers:
+            if lover.age_min is None or lover.age_max is None:
+                continue
+            checked += 1
+            expected = set(candidate_queryset(lover, today).values_list('id', flat=True))
+            found = set(index.candidate_ids(lover, today))
+            if expected != found:
+                mismatches += 1
+                self.stdout.write(self.style.WARNING(
+                    'lover %s: missing from index %s, unexpected in index %s' % (
+                        lover.id, sorted(expected - found), sorted(found - expected))
+                ))
+        style = self.style.SUCCESS if mismatches == 0 else self.style.ERROR
+        self.stdout.write(style('%d lovers checked, %d mismatches' % (checked, mismatches)))
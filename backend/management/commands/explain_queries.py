@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from backend.matching import candidate_queryset
+from backend.models import Lover
+
+
+class Command(BaseCommand):
+    help = 'Print the EXPLAIN output of the main queries of the API for a lover'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lover', type=int, default=None, help='Id of the lover to explain the queries of')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run the queries and report actual timings (MySQL 8.0.18+ and Postgres)')
+
+    def handle(self, *args, **options):
+        lovers = Lover.objects.exclude(age_min=None).exclude(age_max=None)
+        lover = lovers.filter(id=options['lover']).first() if options['lover'] else lovers.first()
+        if lover is None:
+            raise CommandError('No lover to explain the queries of')
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor == 'sqlite':
+                raise CommandError('--analyze is not supported by SQLite')
+            explain_options['analyze'] = True
+
+        other = lovers.exclude(id=lover.id).values_list('id', flat=True).first() or lover.id
+        queries = [
+            ('candidates', candidate_queryset(lover).order_by('id')[:21]),
+            ('matches', Lover.objects.filter(matched_by__lover=lover).order_by('id')),
+            ('like reciprocity', lover.likers.filter(id=other)),
+            ('photos', lover.photos.all()),
+        ]
+        self.stdout.write('database: %s, lover %s' % (connection.vendor, lover.id))
+        for name, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING('\n%s' % name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
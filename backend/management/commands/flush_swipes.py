@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backend.swipes import flush_swipes
+
+
+class Command(BaseCommand):
+    help = 'Move the buffered swipes to the likes and dislikes tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and flush every INTERVAL seconds')
+        parser.add_argument('--batch-size', type=int, default=settings.SWIPE_FLUSH_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = 0
+            while True:
+                count = flush_swipes(options['batch_size'])
+                if not count:
+                    break
+                flushed += count
+            self.stdout.write('%d swipes flushed' % flushed)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
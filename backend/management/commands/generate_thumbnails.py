@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from backend.images import PHOTO_SIZES, generate_derivatives
+from backend.models import Photo
+
+
+class Command(BaseCommand):
+    help = 'Create the resized versions of the photos uploaded without them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Also regenerate the photos that already have them')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.all()
+        if not options['all']:
+            missing = Q()
+            for field, size in PHOTO_SIZES:
+                missing |= Q(**{field: None}) | Q(**{field: ''})
+            photos = photos.filter(missing)
+        done = failed = 0
+        for photo in photos.iterator():
+            try:
+                generate_derivatives(photo)
+                done += 1
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write('photo %s: %s' % (photo.id, e))
+        self.stdout.write(self.style.SUCCESS('%d photos resized, %d failed' % (done, failed)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Photo
+from backend.tasks import process_photo
+
+
+class Command(BaseCommand):
+    help = 'Process the uploaded photos still pending, e.g. after a restart of the workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stuck', action='store_true',
+                            help='Also retry the photos left processing by a worker that was stopped')
+
+    def handle(self, *args, **options):
+        if options['stuck']:
+            Photo.objects.filter(status=Photo.PROCESSING).update(status=Photo.PENDING)
+        processed = 0
+        for photo_id in list(Photo.objects.filter(status=Photo.PENDING).values_list('id', flat=True)):
+            processed += process_photo(photo_id)
+        self.stdout.write(self.style.SUCCESS('%d photos processed' % processed))
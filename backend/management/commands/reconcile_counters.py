@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from backend.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the like, dislike and match counters of the lovers from the swipes and matches tables'
+
+    def handle(self, *args, **options):
+        self.stdout.write('%d lovers reconciled' % reconcile())
@@ -0,0 +1,113 @@
+import heapq
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from backend.models import City, Gender, Lover, Photo
+
+USERNAME_PREFIX = 'seed_'
+PASSWORD = 'lovocco-seed'
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic cities, genders, lovers, photos and swipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=10)
+        parser.add_argument('--lovers', type=int, default=1000)
+        parser.add_argument('--photos', type=int, default=3, help='Photos per lover')
+        parser.add_argument('--likes', type=int, default=20, help='Average likes given per lover')
+        parser.add_argument('--dislikes', type=int, default=20, help='Average dislikes given per lover')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--clear', action='store_true', help='Delete the previously seeded lovers first')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['clear']:
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+        if not Gender.objects.exists():
+            Gender.objects.bulk_create([Gender(code='H', label='Homme'), Gender(code='F', label='Femme')])
+        genders = list(Gender.objects.all())
+        cities = list(City.objects.all())
+        if len(cities) < options['cities']:
+            City.objects.bulk_create([
+                City(name='Ville %d' % i) for i in range(len(cities), options['cities'])
+            ])
+            cities = list(City.objects.all())
+        cities = cities[:options['cities']]
+
+        # hashing is slow on purpose, every seeded user shares the same password
+        password = make_password(PASSWORD)
+        first = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        last_user_id = User.objects.aggregate(Max('id'))['id__max'] or 0
+        User.objects.bulk_create([
+            User(username=username, email='%s@lovocco.test' % username, password=password, first_name=username)
+            for username in ('%s%d' % (USERNAME_PREFIX, i) for i in range(first, first + options['lovers']))
+        ])
+        # new rows are selected by id rather than with a list of parameters, which SQLite bounds
+        new_users = User.objects.filter(id__gt=last_user_id, username__startswith=USERNAME_PREFIX)
+        users = list(new_users.values_list('id', flat=True))
+
+        today = date.today()
+        lovers = []
+        for user_id in users:
+            age = rng.randint(18, 60)
+            gender = rng.choice(genders)
+            # most lovers look for another gender
+            target_gender = rng.choice(genders) if rng.random() < 0.1 else rng.choice(
+                [x for x in genders if x != gender] or genders)
+            lovers.append(Lover(
+                user_id=user_id,
+                configured=True,
+                name='Lover %d' % user_id,
+                city=rng.choice(cities),
+                gender=gender,
+                target_gender=target_gender,
+                birth_date=today - timedelta(days=age * 365 + rng.randint(0, 364)),
+                age_min=max(18, age - rng.randint(2, 10)),
+                age_max=age + rng.randint(2, 10),
+            ))
+        Lover.objects.bulk_create(lovers)
+        lovers = list(Lover.objects.filter(user__in=new_users).values_list('id', 'city_id', 'gender_id',
+                                                                           'target_gender_id'))
+
+        Photo.objects.bulk_create([
+            Photo(lover_id=lover_id, image='seed/%d.jpg' % i, thumbnail='seed/%d_thumbnail.jpg' % i,
+                  card='seed/%d_card.jpg' % i, full='seed/%d_full.jpg' % i)
+            for lover_id, city_id, gender_id, target_gender_id in lovers for i in range(options['photos'])
+        ])
+
+        # swipes stay within the pool a lover is shown, and favour a few popular profiles
+        pools = {}
+        for lover in lovers:
+            pools.setdefault((lover[1], lover[2], lover[3]), []).append(lover[0])
+        likes, dislikes = [], []
+        for lover_id, city_id, gender_id, target_gender_id in lovers:
+            pool = [x for x in pools.get((city_id, target_gender_id, gender_id), []) if x != lover_id]
+            if not pool:
+                continue
+            count = min(len(pool), rng.randint(0, options['likes'] * 2) + rng.randint(0, options['dislikes'] * 2))
+            # weighted sampling without replacement, the weight of the n-th profile of a pool is 1 / n
+            swiped = heapq.nlargest(count, range(len(pool)), key=lambda rank: rng.random() ** (rank + 1))
+            swiped = [pool[rank] for rank in swiped]
+            like_ratio = options['likes'] / max(1, options['likes'] + options['dislikes'])
+            for swiped_id in swiped:
+                if rng.random() < like_ratio:
+                    likes.append(Lover.likes.through(from_lover_id=lover_id, to_lover_id=swiped_id))
+                else:
+                    dislikes.append(Lover.dislikes.through(from_lover_id=lover_id, to_lover_id=swiped_id))
+        Lover.likes.through.objects.bulk_create(likes)
+        Lover.dislikes.through.objects.bulk_create(dislikes)
+        call_command('backfill_matches', stdout=self.stdout)
+        call_command('reconcile_counters', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS('%d lovers, %d photos, %d likes and %d dislikes created' % (
+            len(lovers), len(lovers) * options['photos'], len(likes), len(dislikes))))
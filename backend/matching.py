@@ -0,0 +1,439 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, namedtuple
+from itertools import islice
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef
+
+from backend.geo import city_index
+from backend.models import Lover, PendingSwipe
+
+IndexEntry = namedtuple('IndexEntry', 'id key birth_date age_min age_max is_active')
+DeckEntry = namedtuple('DeckEntry', 'expires_at profile cities birth_date_window age ids ranking')
+
+
+def birth_date_window(lover: Lover, today=None):
+    """Return the (oldest, youngest) birth dates accepted by ``lover``."""
+    today = today or datetime.today()
+    birthday_min = (today - relativedelta(years=lover.age_max)).date()
+    birthday_max = (today - relativedelta(years=lover.age_min)).date()
+    return birthday_min, birthday_max
+
+
+def candidate_queryset(lover: Lover, today=None):
+    """
+    The ORM version of the candidate predicate. Liked and disliked lovers are
+    excluded with correlated NOT EXISTS subqueries on the through tables and
+    on the buffered swipes, so the query stays one round trip whatever the
+    swipe history of ``lover``. The cities within the search radius of
+    ``lover`` come from ``backend.geo.city_index``.
+    """
+    today = today or datetime.today()
+    birthday_min, birthday_max = birth_date_window(lover, today)
+    age = lover.get_age(today)
+    return Lover.objects.annotate(
+        liked=Exists(Lover.likes.through.objects.filter(from_lover=lover.id, to_lover=OuterRef('pk'))),
+        disliked=Exists(Lover.dislikes.through.objects.filter(from_lover=lover.id, to_lover=OuterRef('pk'))),
+        swiped=Exists(PendingSwipe.objects.filter(lover=lover.id, target=OuterRef('pk'))),
+    ).filter(
+        gender=lover.target_gender,
+        target_gender=lover.gender,
+        city__in=city_index.nearby(lover.city_id, lover.search_radius),
+        user__is_active=True,
+        birth_date__gte=birthday_min,
+        birth_date__lte=birthday_max,
+        age_min__lte=age,
+        age_max__gte=age,
+        liked=False,
+        disliked=False,
+        swiped=False,
+    ).exclude(id=lover.id)
+
+
+class MatchingIndex:
+    """
+    Process-local index of lovers used to answer candidate queries without
+    scanning the ``Lover`` table.
+
+    Lovers are bucketed by (city, gender, target_gender) and each bucket keeps
+    its members sorted by birth date, so the age window of a query is two
+    bisects. The index also keeps the set of ids every lover already swiped.
+    It is loaded lazily, kept current by the signals in ``backend.signals`` and
+    rebuilt every ``MATCHING_INDEX_TTL`` seconds to pick up writes made by other
+    worker processes.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._entries = {}
+        self._buckets = {}
+        self._swiped = {}
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._entries = {}
+            self._buckets = {}
+            self._swiped = {}
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self.loaded and (self.ttl is None or time.monotonic() - self._loaded_at < self.ttl):
+                return
+            self.load()
+
+    def load(self):
+        entries, buckets, swiped = {}, {}, {}
+        rows = Lover.objects.values_list(
+            'id', 'city_id', 'gender_id', 'target_gender_id', 'birth_date', 'age_min', 'age_max', 'user__is_active'
+        )
+        for lover_id, city_id, gender_id, target_gender_id, birth_date, age_min, age_max, is_active in rows.iterator():
+            entry = IndexEntry(lover_id, (city_id, gender_id, target_gender_id), birth_date, age_min, age_max,
+                               is_active)
+            entries[lover_id] = entry
+            buckets.setdefault(entry.key, []).append((birth_date, lover_id))
+        for bucket in buckets.values():
+            bucket.sort()
+        for through in (Lover.likes.through, Lover.dislikes.through):
+            for from_id, to_id in through.objects.values_list('from_lover_id', 'to_lover_id').iterator():
+                swiped.setdefault(from_id, set()).add(to_id)
+        for from_id, to_id in PendingSwipe.objects.values_list('lover_id', 'target_id').iterator():
+            swiped.setdefault(from_id, set()).add(to_id)
+        with self._lock:
+            self._entries, self._buckets, self._swiped = entries, buckets, swiped
+            self._loaded_at = time.monotonic()
+
+    @staticmethod
+    def _age(value):
+        # the saved instance keeps the values it was given, my_profile assigns them from the request body
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def update_lover(self, lover: Lover, is_active=None):
+        if is_active is None:
+            is_active = lover.user.is_active
+        entry = IndexEntry(lover.id, (lover.city_id, lover.gender_id, lover.target_gender_id), lover.birth_date,
+                           self._age(lover.age_min), self._age(lover.age_max), is_active)
+        with self._lock:
+            if not self.loaded:
+                return
+            self._remove_entry(lover.id)
+            self._entries[lover.id] = entry
+            insort(self._buckets.setdefault(entry.key, []), (entry.birth_date, entry.id))
+
+    def set_active(self, lover_id, is_active):
+        with self._lock:
+            entry = self._entries.get(lover_id)
+            if entry is not None:
+                self._entries[lover_id] = entry._replace(is_active=is_active)
+
+    def remove_lover(self, lover_id):
+        with self._lock:
+            if not self.loaded:
+                return
+            self._remove_entry(lover_id)
+            self._swiped.pop(lover_id, None)
+
+    def _remove_entry(self, lover_id):
+        entry = self._entries.pop(lover_id, None)
+        if entry is None:
+            return
+        bucket = self._buckets.get(entry.key, [])
+        position = bisect_left(bucket, (entry.birth_date, entry.id))
+        if position < len(bucket) and bucket[position] == (entry.birth_date, entry.id):
+            del bucket[position]
+
+    def add_swipes(self, lover_id, swiped_ids):
+        with self._lock:
+            if self.loaded:
+                self._swiped.setdefault(lover_id, set()).update(swiped_ids)
+
+    def candidate_ids(self, lover: Lover, today=None):
+        """Return the ids of the candidates of ``lover``, youngest last within each city."""
+        today = today or datetime.today()
+        self.ensure_loaded()
+        birthday_min, birthday_max = birth_date_window(lover, today)
+        age = lover.get_age(today)
+        cities = city_index.nearby(lover.city_id, lover.search_radius)
+        with self._lock:
+            swiped = self._swiped.get(lover.id, ())
+            result = []
+            for city_id in cities:
+                bucket = self._buckets.get((city_id, lover.target_gender_id, lover.gender_id), [])
+                start = bisect_left(bucket, (birthday_min,))
+                end = bisect_right(bucket, (birthday_max, float('inf')))
+                for _, candidate_id in bucket[start:end]:
+                    if candidate_id == lover.id or candidate_id in swiped:
+                        continue
+                    entry = self._entries[candidate_id]
+                    if not entry.is_active or entry.age_min is None or entry.age_max is None:
+                        continue
+                    if entry.age_min <= age <= entry.age_max:
+                        result.append(candidate_id)
+        return result
+
+
+index = MatchingIndex(ttl=settings.MATCHING_INDEX_TTL)
+
+
+class DeckCache:
+    """
+    Bounded LRU cache of lover id -> sorted ids of its candidates, with a time
+    to live.
+
+    A deck is built on the first candidates request of a lover and then only
+    the page shown is read from the database, through the candidate predicate
+    so that ids made stale by other workers are filtered out, and dropped from
+    the deck. Decks are kept current by the signals in ``backend.signals``:
+    swiped ids are removed, the deck of a lover whose profile changed is
+    rebuilt, and a lover who is saved is added to the decks of the lovers it
+    is a candidate for and removed from the others.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # (gender, target_gender) -> ids of the lovers with a deck
+        self._owners = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def profile(lover: Lover):
+        return lover.gender_id, lover.target_gender_id, lover.city_id, lover.search_radius, lover.birth_date, \
+            lover.age_min, lover.age_max
+
+    @staticmethod
+    def build(lover: Lover, today=None):
+        if settings.MATCHING_USE_INDEX:
+            return sorted(index.candidate_ids(lover, today))
+        return list(candidate_queryset(lover, today).order_by('id').values_list('id', flat=True))
+
+    def _get(self, lover: Lover):
+        entry = self._entries.get(lover.id)
+        if entry is not None and (entry.expires_at < time.monotonic() or entry.profile != self.profile(lover)):
+            return None
+        if entry is not None:
+            self._entries.move_to_end(lover.id)
+        return entry
+
+    def page_ids(self, lover: Lover, today=None, after=None, limit=None):
+        """Return the candidate ids of ``lover`` after the id ``after``, at most ``limit + 1`` of them."""
+        today = today or datetime.today()
+        with self._lock:
+            entry = self._get(lover)
+            if entry is not None:
+                return self._page(entry.ids, after, limit)
+        ids = self.build(lover, today)
+        self.set(lover, ids, today)
+        return self._page(ids, after, limit)
+
+    def ranked_page(self, lover: Lover, rank, today=None, after=None, limit=None):
+        """
+        Return the ids of the deck of ``lover`` ranked by ``rank`` after the
+        (score, id) position ``after``, at most ``limit + 1`` of them, and
+        their scores. ``rank(ids)`` returns the ids ordered by decreasing
+        score, then by id, and their scores; it is called once per deck. The
+        ids swiped since are skipped, the lovers added since wait for the next
+        build of the deck.
+        """
+        today = today or datetime.today()
+        with self._lock:
+            entry = self._get(lover)
+        if entry is None:
+            self.set(lover, self.build(lover, today), today)
+            with self._lock:
+                entry = self._get(lover)
+        if entry is None:
+            return [], []
+        ranking = entry.ranking
+        if ranking is None:
+            ranked_ids, scores = rank(list(entry.ids))
+            ranking = [(-score, lover_id) for score, lover_id in zip(scores, ranked_ids)]
+            with self._lock:
+                if self._entries.get(lover.id) is entry:
+                    self._entries[lover.id] = entry._replace(ranking=ranking)
+        start = 0 if after is None else bisect_right(ranking, (-after[0], after[1]))
+        ids, scores = [], []
+        with self._lock:
+            for score, lover_id in islice(ranking, start, None):
+                position = bisect_left(entry.ids, lover_id)
+                if position < len(entry.ids) and entry.ids[position] == lover_id:
+                    ids.append(lover_id)
+                    scores.append(-score)
+                    if limit is not None and len(ids) > limit:
+                        break
+        return ids, scores
+
+    @staticmethod
+    def _page(ids, after, limit):
+        start = 0 if after is None else bisect_right(ids, after)
+        return ids[start:] if limit is None else ids[start:start + limit + 1]
+
+    def set(self, lover: Lover, ids, today=None):
+        if self.max_size <= 0:
+            return
+        entry = DeckEntry(time.monotonic() + self.ttl, self.profile(lover),
+                          city_index.nearby(lover.city_id, lover.search_radius), birth_date_window(lover, today),
+                          lover.get_age(today), list(ids), None)
+        with self._lock:
+            self._remove_entry(lover.id)
+            self._entries[lover.id] = entry
+            self._owners.setdefault(entry.profile[:2], set()).add(lover.id)
+            while len(self._entries) > self.max_size:
+                self._remove_entry(next(iter(self._entries)))
+
+    def _remove_entry(self, lover_id):
+        entry = self._entries.pop(lover_id, None)
+        if entry is not None:
+            self._owners[entry.profile[:2]].discard(lover_id)
+
+    def invalidate(self, lover_id):
+        with self._lock:
+            self._remove_entry(lover_id)
+
+    def remove_ids(self, lover_id, swiped_ids):
+        with self._lock:
+            entry = self._entries.get(lover_id)
+            if entry is None:
+                return
+            for swiped_id in swiped_ids:
+                position = bisect_left(entry.ids, swiped_id)
+                if position < len(entry.ids) and entry.ids[position] == swiped_id:
+                    del entry.ids[position]
+
+    @staticmethod
+    def _accepts(owner_id, entry: DeckEntry, lover: Lover, age_min, age_max):
+        birthday_min, birthday_max = entry.birth_date_window
+        return owner_id != lover.id and (lover.target_gender_id, lover.gender_id) == entry.profile[:2] \
+            and lover.city_id in entry.cities and age_min <= entry.age <= age_max \
+            and birthday_min <= lover.birth_date <= birthday_max
+
+    def update_candidate(self, lover: Lover, is_active=None):
+        """
+        Add ``lover`` to the decks of the lovers it is a candidate for and did
+        not swipe it yet, and remove it from the other decks of the lovers
+        looking for its gender. A lover whose gender changed stays in the decks
+        of the others until the candidate predicate drops it from them.
+        """
+        if not self._entries:
+            return
+        if is_active is None:
+            is_active = lover.user.is_active
+        try:
+            age_min, age_max = int(lover.age_min), int(lover.age_max)
+        except (TypeError, ValueError):
+            is_active = False
+        added = []
+        with self._lock:
+            for owner_id in self._owners.get((lover.target_gender_id, lover.gender_id), ()):
+                entry = self._entries[owner_id]
+                position = bisect_left(entry.ids, lover.id)
+                present = position < len(entry.ids) and entry.ids[position] == lover.id
+                if is_active and self._accepts(owner_id, entry, lover, age_min, age_max):
+                    if not present:
+                        added.append(owner_id)
+                elif present:
+                    del entry.ids[position]
+        if not added:
+            return
+        added = set(added) - swiped_by(lover.id, added)
+        with self._lock:
+            for owner_id in added:
+                entry = self._entries.get(owner_id)
+                # the deck may have been rebuilt or evicted in the meantime
+                if entry is not None and self._accepts(owner_id, entry, lover, age_min, age_max):
+                    position = bisect_left(entry.ids, lover.id)
+                    if position == len(entry.ids) or entry.ids[position] != lover.id:
+                        entry.ids.insert(position, lover.id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+
+
+decks = DeckCache(settings.DECK_CACHE_SIZE, settings.DECK_CACHE_TTL)
+
+
+def swiped_by(lover_id, owner_ids):
+    """Return the ids among ``owner_ids`` of the lovers who already swiped ``lover_id``, flushed or buffered."""
+    owner_ids = list(owner_ids)
+    return set(Lover.likes.through.objects.filter(to_lover=lover_id, from_lover__in=owner_ids)
+               .values_list('from_lover_id', flat=True)
+               .union(Lover.dislikes.through.objects.filter(to_lover=lover_id, from_lover__in=owner_ids)
+                      .values_list('from_lover_id', flat=True),
+                      PendingSwipe.objects.filter(target=lover_id, lover__in=owner_ids)
+                      .values_list('lover_id', flat=True)))
+
+
+def _first_candidates(queryset, next_ids, count, discard=None):
+    """
+    Return the first ``count`` ids that ``queryset`` selects among the sorted
+    ids returned by ``next_ids(after)``, reading them until there are enough or
+    ``next_ids`` returns none. The ids that ``queryset`` rejects are passed to
+    ``discard``.
+    """
+    found, after = [], None
+    while len(found) < count:
+        ids = next_ids(after)
+        if not ids:
+            break
+        kept = set(queryset.filter(id__in=ids).values_list('id', flat=True))
+        found += [x for x in ids if x in kept]
+        if discard is not None and len(kept) < len(ids):
+            discard([x for x in ids if x not in kept])
+        after = ids[-1]
+    return found[:count]
+
+
+def get_candidates(lover: Lover, today=None, after=None, limit=None):
+    """
+    Return the candidates of ``lover`` ordered by id, starting after the id
+    ``after``. The ids are taken from the deck of ``lover`` when
+    ``DECK_CACHE_SIZE`` is set, or from the matching index when
+    ``MATCHING_USE_INDEX`` is enabled, in which case at least the first
+    ``limit + 1`` candidates are returned: the ids are checked against the
+    ORM predicate, which filters out the ids made stale by other workers.
+    """
+    queryset = candidate_queryset(lover, today)
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    if settings.DECK_CACHE_SIZE > 0:
+        if limit is None:
+            return queryset.filter(id__in=decks.page_ids(lover, today, after)).order_by('id')
+        ids = _first_candidates(queryset, lambda x: decks.page_ids(lover, today, after if x is None else x, limit),
+                                limit + 1, lambda x: decks.remove_ids(lover.id, x))
+    elif settings.MATCHING_USE_INDEX:
+        ids = sorted(i for i in index.candidate_ids(lover, today) if after is None or i > after)
+        if limit is None:
+            return queryset.filter(id__in=ids).order_by('id')
+        ids = _first_candidates(
+            queryset, lambda x: ids[0 if x is None else bisect_right(ids, x):][:limit + 1], limit + 1)
+    else:
+        return queryset.order_by('id')
+    return Lover.objects.filter(id__in=ids).order_by('id')
+
+
+def refresh_user(user: User):
+    """Propagate a change of ``user.is_active`` to the index and the decks."""
+    lover = Lover.objects.filter(user=user).first() if index.loaded or decks else None
+    if lover is not None:
+        index.set_active(lover.id, user.is_active)
+        decks.update_candidate(lover, user.is_active)
@@ -0,0 +1,139 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = (
+    ('lovocco_request_duration_seconds', 'Wall time of the requests', DURATION_BUCKETS),
+    ('lovocco_request_db_duration_seconds', 'Time spent in SQL queries by the requests', DURATION_BUCKETS),
+    ('lovocco_request_queries', 'Number of SQL queries issued by the requests', QUERY_BUCKETS),
+)
+REQUESTS_TOTAL = 'lovocco_requests_total'
+CONNECTIONS_TOTAL = 'lovocco_db_connections_total'
+
+
+class Registry:
+    """
+    In-process histograms of the requests, labelled by route and method.
+
+    Every gunicorn worker has its own registry. When ``METRICS_DIR`` is set,
+    each worker also writes its snapshot to a file of that directory at most
+    every ``METRICS_FLUSH_INTERVAL`` seconds, and the metrics endpoint adds up
+    the files of all the workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name, _, _ in HISTOGRAMS}
+        self._requests = {}
+        self._connections = {}
+        self._flushed_at = 0
+
+    def observe(self, route, method, status, duration, db_duration, queries):
+        labels = (route, method)
+        with self._lock:
+            for (name, _, buckets), value in zip(HISTOGRAMS, (duration, db_duration, queries)):
+                histogram = self._histograms[name].get(labels)
+                if histogram is None:
+                    histogram = self._histograms[name][labels] = [[0] * len(buckets), 0, 0]
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        histogram[0][i] += 1
+                histogram[1] += value
+                histogram[2] += 1
+            key = (route, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+        if settings.METRICS_DIR and time.monotonic() - self._flushed_at > settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def count_connection(self, alias, event):
+        """Count a database connection event: checkout, wait, reconnect or discard."""
+        key = (alias, event)
+        with self._lock:
+            self._connections[key] = self._connections.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': {
+                    name: [[list(labels), values[0][:], values[1], values[2]] for labels, values in series.items()]
+                    for name, series in self._histograms.items()
+                },
+                'requests': [[list(key), count] for key, count in self._requests.items()],
+                'connections': [[list(key), count] for key, count in self._connections.items()],
+            }
+
+    def flush(self):
+        """Write the snapshot of this process to METRICS_DIR, atomically."""
+        self._flushed_at = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path, os.path.join(settings.METRICS_DIR, '%d.json' % os.getpid()))
+
+    def collect(self):
+        """Return the snapshots of every worker, this one included."""
+        if not settings.METRICS_DIR:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+
+registry = Registry()
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+
+
+def render(snapshots):
+    """Render merged snapshots in the Prometheus text exposition format."""
+    lines = []
+    for name, help_text, buckets in HISTOGRAMS:
+        merged = {}
+        for snapshot in snapshots:
+            for labels, counts, total, count in snapshot['histograms'].get(name, []):
+                current = merged.setdefault(tuple(labels), [[0] * len(buckets), 0, 0])
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+                current[2] += count
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for (route, method), (counts, total, count) in sorted(merged.items()):
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append('%s_bucket{%s} %d' % (name, _labels(route=route, method=method, le=bound), bucket_count))
+            lines.append('%s_bucket{%s} %d' % (name, _labels(route=route, method=method, le='+Inf'), count))
+            lines.append('%s_sum{%s} %s' % (name, _labels(route=route, method=method), repr(float(total))))
+            lines.append('%s_count{%s} %d' % (name, _labels(route=route, method=method), count))
+    requests = {}
+    for snapshot in snapshots:
+        for key, count in snapshot['requests']:
+            requests[tuple(key)] = requests.get(tuple(key), 0) + count
+    lines.append('# HELP %s Number of requests' % REQUESTS_TOTAL)
+    lines.append('# TYPE %s counter' % REQUESTS_TOTAL)
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append('%s{%s} %d' % (REQUESTS_TOTAL, _labels(route=route, method=method, status=status), count))
+    connections = {}
+    for snapshot in snapshots:
+        for key, count in snapshot.get('connections', []):
+            connections[tuple(key)] = connections.get(tuple(key), 0) + count
+    lines.append('# HELP %s Database connections checked out, waited for, opened and discarded' % CONNECTIONS_TOTAL)
+    lines.append('# TYPE %s counter' % CONNECTIONS_TOTAL)
+    for (alias, event), count in sorted(connections.items()):
+        lines.append('%s{%s} %d' % (CONNECTIONS_TOTAL, _labels(alias=alias, event=event), count))
+    return '\n'.join(lines) + '\n'
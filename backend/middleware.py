@@ -0,0 +1,81 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from backend.metrics import registry
+
+
+def record_queries(record_query) -> ExitStack:
+    """Wrap the queries of every connection in ``record_query`` until the returned stack is closed."""
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(record_query))
+    return stack
+
+
+class ObservedStream:
+    """
+    Streaming content recording the queries run while it is iterated, and
+    calling ``observe`` once the response is closed.
+    """
+
+    def __init__(self, content, record_query, observe):
+        self.content = content
+        self.record_query = record_query
+        self.observe = observe
+
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            # recorded a chunk at a time, the server may run other code between chunks
+            with record_queries(self.record_query):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+
+    def close(self):
+        observe, self.observe = self.observe, None
+        if observe is not None:
+            observe()
+
+
+class MetricsMiddleware:
+    """
+    Record the wall time, SQL time and SQL query count of every request in
+    ``backend.metrics``. Streamed responses are recorded when closed, their
+    content included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {'queries': 0, 'db_duration': 0.0}
+
+        def record_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['db_duration'] += time.perf_counter() - start
+                stats['queries'] += 1
+
+        start = time.perf_counter()
+        with record_queries(record_query):
+            response = self.get_response(request)
+
+        def observe():
+            # routes rather than paths, so that ids do not multiply the series
+            match = getattr(request, 'resolver_match', None)
+            route = match.route if match is not None else '<unmatched>'
+            registry.observe(route, request.method, response.status_code, time.perf_counter() - start,
+                             stats['db_duration'], stats['queries'])
+
+        if response.streaming:
+            response.streaming_content = ObservedStream(response.streaming_content, record_query, observe)
+        else:
+            observe()
+        return response
@@ -0,0 +1,71 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:11
+
+import backend.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Gender',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=3)),
+                ('label', models.CharField(max_length=30)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Lover',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('configured', models.BooleanField(default=False)),
+                ('name', models.CharField(max_length=50)),
+                ('birth_date', models.DateField()),
+                ('description', models.TextField(blank=True, null=True)),
+                ('age_min', models.IntegerField(default=18, null=True)),
+                ('age_max', models.IntegerField(default=60, null=True)),
+                ('city', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.City')),
+                ('dislikes', models.ManyToManyField(related_name='dislikers', to='backend.Lover')),
+                ('gender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.Gender')),
+                ('likes', models.ManyToManyField(related_name='likers', to='backend.Lover')),
+                ('target_gender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.Gender')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Photo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to=backend.models.get_image_path)),
+                ('lover', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photos', to='backend.Lover')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('lover', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='backend.Lover')),
+                ('matched', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matched_by', to='backend.Lover')),
+            ],
+            options={
+                'unique_together': {('lover', 'matched')},
+            },
+        ),
+    ]
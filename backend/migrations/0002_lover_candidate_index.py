@@ -0,0 +1,17 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lover',
+            index=models.Index(fields=['city', 'gender', 'target_gender', 'birth_date'], name='lover_candidate_idx'),
+        ),
+    ]
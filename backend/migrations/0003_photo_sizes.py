@@ -0,0 +1,29 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:12
+
+import backend.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_lover_candidate_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='card',
+            field=models.ImageField(blank=True, null=True, upload_to=backend.models.get_image_path),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='full',
+            field=models.ImageField(blank=True, null=True, upload_to=backend.models.get_image_path),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to=backend.models.get_image_path),
+        ),
+    ]
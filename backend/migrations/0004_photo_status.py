@@ -0,0 +1,18 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_photo_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='status',
+            field=models.CharField(choices=[('pending', 'En attente'), ('processing', 'En cours de traitement'), ('ready', 'Prête'), ('failed', 'Invalide')], default='ready', max_length=10),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_photo_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSwipe',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('liked', models.BooleanField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('lover', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.Lover')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.Lover')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pendingswipe',
+            index=models.Index(fields=['lover', 'target'], name='pending_swipe_lover_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingswipe',
+            index=models.Index(fields=['target', 'lover'], name='pending_swipe_target_idx'),
+        ),
+    ]
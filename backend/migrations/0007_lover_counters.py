@@ -0,0 +1,57 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:31
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# backend.counters.reconcile as of this migration, copied so that later changes to it do not change this one
+def _count(queryset, column, distinct=None):
+    count = Count(distinct, distinct=True) if distinct else Count('*')
+    return Coalesce(Subquery(queryset.filter(**{column: OuterRef('pk')}).order_by().values(column)
+                             .annotate(count=count).values('count'), output_field=IntegerField()), Value(0))
+
+
+def _pending(PendingSwipe, through, liked):
+    return PendingSwipe.objects.annotate(
+        flushed=Exists(through.objects.filter(from_lover=OuterRef('lover'), to_lover=OuterRef('target'))),
+    ).filter(liked=liked, flushed=False)
+
+
+def reconcile_counters(apps, schema_editor):
+    Lover = apps.get_model('backend', 'Lover')
+    Match = apps.get_model('backend', 'Match')
+    PendingSwipe = apps.get_model('backend', 'PendingSwipe')
+    Lover.objects.update(
+        like_count=_count(Lover.likes.through.objects.all(), 'to_lover')
+        + _count(_pending(PendingSwipe, Lover.likes.through, True), 'target', 'lover'),
+        dislike_count=_count(Lover.dislikes.through.objects.all(), 'to_lover')
+        + _count(_pending(PendingSwipe, Lover.dislikes.through, False), 'target', 'lover'),
+        match_count=_count(Match.objects.all(), 'lover'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_city_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lover',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lover',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lover',
+            name='match_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(reconcile_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.11 on 2026-10-18 11:33
+
+import backend.models
+import backend.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_lover_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='photo',
+            name='card',
+            field=models.ImageField(blank=True, null=True, storage=backend.storage.HashedStorage(), upload_to=backend.models.get_image_path),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='full',
+            field=models.ImageField(blank=True, null=True, storage=backend.storage.HashedStorage(), upload_to=backend.models.get_image_path),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(storage=backend.storage.HashedStorage(), upload_to=backend.models.get_image_path),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=backend.storage.HashedStorage(), upload_to=backend.models.get_image_path),
+        ),
+    ]
@@ -4,7 +4,9 @@ from dateutil.relativedelta import relativedelta
 from django.contrib.auth.models import User
 from django.db import models
 from django.db.models import BooleanField, CharField, ForeignKey, DateField, TextField, IntegerField, OneToOneField, \
-    ManyToManyField, ImageField
+    ManyToManyField, ImageField, DateTimeField, FloatField, PositiveIntegerField
+
+from backend.storage import photo_storage
 
 
 class Gender(models.Model):
@@ -17,6 +19,9 @@ class Gender(models.Model):
 
 class City(models.Model):
     name = CharField(max_length=50)
+    # used by backend.geo to find the cities around a lover, cities without them only match themselves
+    latitude = FloatField(null=True, blank=True)
+    longitude = FloatField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -26,6 +31,10 @@ def get_image_path(instance, filename):
     return os.path.join('photos', str(instance.lover.id), filename)
 
 
+def get_staging_path(instance, filename):
+    return os.path.join('staging', str(instance.lover.id), filename)
+
+
 class Lover(models.Model):
     user = OneToOneField(User, on_delete=models.CASCADE)
     configured = BooleanField(default=False)
@@ -37,11 +46,23 @@ class Lover(models.Model):
     target_gender = ForeignKey(Gender, on_delete=models.SET_NULL, related_name='+', null=True)
     age_min = IntegerField(default=18, null=True)
     age_max = IntegerField(default=60, null=True)
+    # in kilometers around the city, candidates are only looked up in the city itself when empty
+    search_radius = PositiveIntegerField(null=True, blank=True)
+    # likes, dislikes and matches received, kept by backend.swipes and rebuilt by the reconcile_counters command
+    like_count = PositiveIntegerField(default=0)
+    dislike_count = PositiveIntegerField(default=0)
+    match_count = PositiveIntegerField(default=0)
     likes = ManyToManyField('self', symmetrical=False, related_name='likers')
     dislikes = ManyToManyField('self', symmetrical=False, related_name='dislikers')
 
-    def get_age(self):
-        today = datetime.today()
+    class Meta:
+        indexes = [
+            # equality columns of the candidates predicate first, then the birth date range
+            models.Index(fields=['city', 'gender', 'target_gender', 'birth_date'], name='lover_candidate_idx'),
+        ]
+
+    def get_age(self, today=None):
+        today = today or datetime.today()
         return today.year - self.birth_date.year - ((today.month, today.day) < (self.birth_date.month, self.birth_date.day))
 
     def __str__(self):
@@ -49,5 +70,56 @@ class Lover(models.Model):
 
 
 class Photo(models.Model):
-    image = ImageField(upload_to=get_image_path)
+    # uploads are stored under staging/ until backend.tasks has processed them
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'En attente'),
+        (PROCESSING, 'En cours de traitement'),
+        (READY, 'Prête'),
+        (FAILED, 'Invalide'),
+    )
+
+    image = ImageField(upload_to=get_image_path, storage=photo_storage)
+    status = CharField(max_length=10, choices=STATUSES, default=READY)
+    # resized versions created by backend.images.generate_derivatives
+    thumbnail = ImageField(upload_to=get_image_path, storage=photo_storage, null=True, blank=True)
+    card = ImageField(upload_to=get_image_path, storage=photo_storage, null=True, blank=True)
+    full = ImageField(upload_to=get_image_path, storage=photo_storage, null=True, blank=True)
     lover = ForeignKey(Lover, on_delete=models.CASCADE, related_name='photos')
+
+
+class Match(models.Model):
+    """
+    A mutual like, stored once for each side so that the matches of a lover
+    are a single indexed lookup on ``lover``.
+    """
+    lover = ForeignKey(Lover, on_delete=models.CASCADE, related_name='matches')
+    matched = ForeignKey(Lover, on_delete=models.CASCADE, related_name='matched_by')
+    created_at = DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('lover', 'matched')
+
+    def __str__(self):
+        return '%s - %s' % (self.lover, self.matched)
+
+
+class PendingSwipe(models.Model):
+    """
+    A like or dislike not yet written to the ``likes``/``dislikes`` tables.
+    Swipes are appended here when ``SWIPE_BUFFER`` is enabled and moved to the
+    through tables in batches by ``backend.swipes.flush_swipes``.
+    """
+    lover = ForeignKey(Lover, on_delete=models.CASCADE, related_name='+')
+    target = ForeignKey(Lover, on_delete=models.CASCADE, related_name='+')
+    liked = BooleanField()
+    created_at = DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lover', 'target'], name='pending_swipe_lover_idx'),
+            models.Index(fields=['target', 'lover'], name='pending_swipe_target_idx'),
+        ]
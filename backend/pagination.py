@@ -0,0 +1,79 @@
+import base64
+import binascii
+import math
+
+from django.conf import settings
+
+
+class InvalidPageParameter(ValueError):
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+        self.message = message
+
+
+def encode_cursor(lover_id) -> str:
+    return base64.urlsafe_b64encode(str(lover_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value = int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidPageParameter('cursor', 'Curseur invalide')
+    if value < 0:
+        raise InvalidPageParameter('cursor', 'Curseur invalide')
+    return value
+
+
+def encode_rank_cursor(position) -> str:
+    score, lover_id = position
+    return encode_cursor('%r:%d' % (score, lover_id))
+
+
+def decode_rank_cursor(cursor: str):
+    """Decode the (score, id) position of a cursor of the ranked deck."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, lover_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        score, lover_id = float(score), int(lover_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidPageParameter('cursor', 'Curseur invalide')
+    if not math.isfinite(score) or lover_id < 0:
+        raise InvalidPageParameter('cursor', 'Curseur invalide')
+    return score, lover_id
+
+
+def get_page_parameters(request, decode=decode_cursor):
+    """
+    Read the ``cursor`` and ``limit`` query parameters of a deck request.
+    The limit defaults to ``DECK_PAGE_SIZE`` and is capped at ``DECK_MAX_PAGE_SIZE``.
+    """
+    cursor = request.query_params.get('cursor')
+    after = decode(cursor) if cursor not in [None, ''] else None
+    limit = request.query_params.get('limit')
+    if limit in [None, '']:
+        limit = settings.DECK_PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidPageParameter('limit', 'Nombre de profils invalide')
+        if limit <= 0:
+            raise InvalidPageParameter('limit', 'Nombre de profils invalide')
+    return after, min(limit, settings.DECK_MAX_PAGE_SIZE)
+
+
+def paginate(queryset, limit):
+    """
+    Return one page of ``queryset`` and the cursor of the next one, or None
+    when it is the last page. The queryset must be ordered by id and already
+    filtered on the previous cursor. Rows may be instances or values() dicts.
+    """
+    page = list(queryset[:limit + 1])
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        return page, encode_cursor(last['id'] if isinstance(last, dict) else last.id)
+    return page, None
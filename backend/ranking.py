@@ -0,0 +1,169 @@
+from datetime import datetime
+
+from django.conf import settings
+
+from backend.matching import candidate_queryset, decks, index
+from backend.models import Lover
+from backend.serializers import with_age
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# weights of the age of the candidate in the window of the lover, the age of the lover in the window of the
+# candidate, the freshness and the popularity of the candidate
+WEIGHTS = (0.35, 0.35, 0.15, 0.15)
+# days after which a new lover is half as fresh
+FRESHNESS_HALF_LIFE = 14
+# likes for which the popularity is 0.5
+POPULARITY_HALF = 50
+
+COLUMNS = 'id', 'age', 'age_min', 'age_max', 'days', 'likes'
+
+
+def candidate_features(lover: Lover, today=None, limit=None, ids=None):
+    """
+    Return the columns of COLUMNS for the candidates of ``lover``, or for the
+    lovers ``ids`` when they are already known, at most ``limit`` of them: the
+    newest, which the freshness favours. ``days`` is the number of days since
+    the candidate joined and ``likes`` how many lovers like it.
+    """
+    today = today or datetime.today()
+    limit = limit or settings.RANKING_MAX_CANDIDATES
+    if ids is None:
+        querysets = [with_age(candidate_queryset(lover, today), today).order_by('-id')[:limit]]
+    else:
+        ids = sorted(ids)[-limit:]
+        querysets = (with_age(Lover.objects.filter(id__in=ids[i:i + 500]), today) for i in range(0, len(ids), 500))
+    columns = {name: [] for name in COLUMNS}
+    for queryset in querysets:
+        rows = queryset.values_list('id', 'age', 'age_min', 'age_max', 'user__date_joined', 'like_count')
+        for lover_id, age, age_min, age_max, date_joined, likes in rows:
+            columns['id'].append(lover_id)
+            columns['age'].append(age)
+            columns['age_min'].append(age_min)
+            columns['age_max'].append(age_max)
+            columns['days'].append((today.date() - date_joined.date()).days)
+            columns['likes'].append(likes)
+    return columns
+
+
+def _fit(value, low, high):
+    # 1 in the middle of [low, high], decreasing towards and past its bounds
+    return max(0.0, 1 - abs(value - (low + high) / 2) / ((high - low) / 2 + 1))
+
+
+def score_python(lover: Lover, features, today=None):
+    """Score the candidates of ``features`` one at a time, the reference for score_numpy."""
+    age = lover.get_age(today or datetime.today())
+    scores = []
+    for candidate_age, age_min, age_max, days, likes in zip(
+            features['age'], features['age_min'], features['age_max'], features['days'], features['likes']):
+        scores.append(
+            WEIGHTS[0] * _fit(candidate_age, lover.age_min, lover.age_max)
+            + WEIGHTS[1] * _fit(age, age_min, age_max)
+            + WEIGHTS[2] * 0.5 ** (max(days, 0) / FRESHNESS_HALF_LIFE)
+            + WEIGHTS[3] * likes / (likes + POPULARITY_HALF)
+        )
+    return scores
+
+
+def score_numpy(lover: Lover, features, today=None):
+    """Score all the candidates of ``features`` at once, same scores as score_python."""
+    age = lover.get_age(today or datetime.today())
+    candidate_age = numpy.asarray(features['age'], dtype=float)
+    age_min = numpy.asarray(features['age_min'], dtype=float)
+    age_max = numpy.asarray(features['age_max'], dtype=float)
+    days = numpy.maximum(numpy.asarray(features['days'], dtype=float), 0)
+    likes = numpy.asarray(features['likes'], dtype=float)
+    lover_fit = 1 - numpy.abs(candidate_age - (lover.age_min + lover.age_max) / 2) / (
+        (lover.age_max - lover.age_min) / 2 + 1)
+    candidate_fit = 1 - numpy.abs(age - (age_min + age_max) / 2) / ((age_max - age_min) / 2 + 1)
+    return (WEIGHTS[0] * numpy.maximum(lover_fit, 0)
+            + WEIGHTS[1] * numpy.maximum(candidate_fit, 0)
+            + WEIGHTS[2] * 0.5 ** (days / FRESHNESS_HALF_LIFE)
+            + WEIGHTS[3] * likes / (likes + POPULARITY_HALF))
+
+
+def rank(ids, scores, after=None, limit=None):
+    """
+    Return the ids ordered by decreasing score, then by id, starting after the
+    (score, id) position ``after``, and the scores of these ids. At most
+    ``limit + 1`` of them are returned.
+    """
+    if numpy is not None and isinstance(scores, numpy.ndarray):
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        if after is not None:
+            keep = (scores < after[0]) | ((scores == after[0]) & (ids > after[1]))
+            ids, scores = ids[keep], scores[keep]
+        if limit is not None and len(ids) > limit + 1:
+            # only the best limit + 1 scores, and those tied with the last of them, need sorting
+            threshold = numpy.partition(scores, len(scores) - limit - 1)[len(scores) - limit - 1]
+            keep = scores >= threshold
+            ids, scores = ids[keep], scores[keep]
+        order = numpy.lexsort((ids, -scores))
+        if limit is not None:
+            order = order[:limit + 1]
+        return ids[order].tolist(), scores[order].tolist()
+    ranked = sorted(zip(scores, ids), key=lambda x: (-x[0], x[1]))
+    if after is not None:
+        ranked = [x for x in ranked if (-x[0], x[1]) > (-after[0], after[1])]
+    if limit is not None:
+        ranked = ranked[:limit + 1]
+    return [x[1] for x in ranked], [x[0] for x in ranked]
+
+
+def ranked_candidates(lover: Lover, after=None, limit=None, today=None):
+    """
+    Return the ids of one page of the candidates of ``lover`` ranked by score,
+    and the (score, id) position of the next page or None when it is the
+    last one. Only the RANKING_MAX_CANDIDATES newest candidates are ranked,
+    which bounds the time spent per request.
+
+    The ranking is computed once per deck when DECK_CACHE_SIZE is set, on
+    the ids of the deck, otherwise on every request, on the ids of the
+    matching index when MATCHING_USE_INDEX is enabled. The ids of a page are
+    checked against the candidate predicate, and further ids are read until
+    ``limit + 1`` of them pass it.
+    """
+    today = today or datetime.today()
+    score = score_numpy if numpy is not None else score_python
+
+    def rank_ids(ids=None):
+        features = candidate_features(lover, today, ids=ids)
+        return rank(features['id'], score(lover, features, today))
+
+    if settings.DECK_CACHE_SIZE > 0:
+        def next_page(position):
+            return decks.ranked_page(lover, rank_ids, today, position, limit)
+
+        def discard(ids):
+            decks.remove_ids(lover.id, ids)
+    else:
+        features = candidate_features(lover, today, ids=index.candidate_ids(lover, today)
+                                      if settings.MATCHING_USE_INDEX else None)
+        all_scores = score(lover, features, today)
+
+        def next_page(position):
+            return rank(features['id'], all_scores, position, limit)
+
+        def discard(ids):
+            pass
+    queryset = candidate_queryset(lover, today)
+    ids, scores = [], []
+    while limit is None or len(ids) <= limit:
+        page_ids, page_scores = next_page(after)
+        if not page_ids:
+            break
+        kept = set(queryset.filter(id__in=page_ids).values_list('id', flat=True))
+        ids += [x for x in page_ids if x in kept]
+        scores += [x for x, lover_id in zip(page_scores, page_ids) if lover_id in kept]
+        if len(kept) < len(page_ids):
+            discard([x for x in page_ids if x not in kept])
+        if limit is None:
+            break
+        after = page_scores[-1], page_ids[-1]
+    if limit is not None and len(ids) > limit:
+        return ids[:limit], (scores[limit - 1], ids[limit - 1])
+    return ids, None
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+class ReferenceCache:
+    """
+    In-process cache of the serialized reference tables (cities, genders).
+
+    Every table has a version number bumped by the save and delete signals of
+    its model; a cached body is only served while its version is current and
+    it is younger than ``ttl`` seconds, which bounds how long a worker keeps a
+    body changed by another process. The ETag is derived from the body so all
+    workers agree on it.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._entries = {}
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._entries.pop(name, None)
+
+    def get(self, name, build):
+        """Return the (body, etag) of ``name``, calling ``build`` to get its data when needed."""
+        with self._lock:
+            version = self._versions.get(name, 0)
+            entry = self._entries.get(name)
+        if entry is not None and entry[0] == version and time.monotonic() - entry[1] < self.ttl:
+            return entry[2], entry[3]
+        body = json.dumps(build(), cls=DjangoJSONEncoder).encode()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        with self._lock:
+            if self._versions.get(name, 0) == version:
+                self._entries[name] = (version, time.monotonic(), body, etag)
+        return body, etag
+
+
+reference_cache = ReferenceCache(settings.REFERENCE_CACHE_TTL)
+
+
+def reference_response(request, name, build):
+    """Serve the reference table ``name``, answering 304 when the client copy is current."""
+    body, etag = reference_cache.get(name, build)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.REFERENCE_CACHE_TTL)
+    return response
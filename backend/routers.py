@@ -0,0 +1,112 @@
+import hashlib
+import random
+import threading
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+PIN_CACHE = 'replica-pins'
+# models always read from the primary
+PRIMARY_MODELS = ('authtoken.Token',)
+# caches that every worker process sees separately
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+_state = threading.local()
+
+
+def replica(view):
+    """Let the GET requests of ``view`` read from a replica."""
+    view.use_replica = True
+    return view
+
+
+def reset():
+    _state.replica = False
+    _state.wrote = False
+
+
+def pin_key(request, token=None):
+    authorization = 'Token %s' % token if token else request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return 'replica-pin:%s' % hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def is_pinned(request) -> bool:
+    key = pin_key(request) if settings.DB_REPLICAS else None
+    return key is not None and caches[PIN_CACHE].get(key) is not None
+
+
+def pin(request, token=None):
+    """
+    Send the reads of the client of ``request``, or of the client of
+    ``token`` when it just got it, to the primary for DB_REPLICA_PIN_SECONDS.
+    """
+    key = pin_key(request, token) if settings.DB_REPLICAS else None
+    if key is not None:
+        caches[PIN_CACHE].set(key, 1, settings.DB_REPLICA_PIN_SECONDS)
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    if not settings.DB_REPLICAS:
+        return []
+    backend = settings.CACHES.get(PIN_CACHE, {}).get('BACKEND')
+    if backend is None or backend in LOCAL_CACHES:
+        return [checks.Error(
+            "The '%s' cache must be shared by the worker processes when DB_REPLICAS is set" % PIN_CACHE,
+            hint='Use a file, database or memcached cache, see X_REPLICA_PIN_CACHE_BACKEND.',
+            id='backend.E001',
+        )]
+    return []
+
+
+class ReplicaRouter:
+    """
+    Route the reads of the views decorated with ``replica`` to a random
+    database of DB_REPLICAS, and everything else to the primary.
+
+    ReplicaMiddleware decides per request. Once a request writes, its
+    remaining reads go to the primary, and so do the reads of the same
+    client for DB_REPLICA_PIN_SECONDS so that it reads its own writes
+    despite the replication lag. The pins are kept in the 'replica-pins'
+    cache, which has to be shared by the workers for them to hold across
+    workers: check_pin_cache refuses a process-local one.
+
+    Tokens are always read from the primary, a client may use its token as
+    soon as it got it.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in PRIMARY_MODELS:
+            return 'default'
+        if settings.DB_REPLICAS and getattr(_state, 'replica', False) and not getattr(_state, 'wrote', False):
+            return random.choice(settings.DB_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # the state is reset by request_finished, after the streamed responses are consumed
+        reset()
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') or _state.wrote:
+            pin(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _state.replica = bool(settings.DB_REPLICAS) and request.method in ('GET', 'HEAD') \
+            and getattr(view_func, 'use_replica', False) and not is_pinned(request)
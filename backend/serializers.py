@@ -1,13 +1,18 @@
+from datetime import datetime
+
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import ExtractYear
 from rest_framework import serializers
-from backend.models import Lover, City, Gender, Photo
+from backend.models import Lover, City, Gender, Photo, get_staging_path
 from lovocco import settings
 
 
 class CitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
-        fields = 'id', 'name'
+        fields = 'id', 'name', 'latitude', 'longitude'
 
 
 class GenderSerializer(serializers.ModelSerializer):
@@ -25,7 +30,25 @@ class UserSerializer(serializers.ModelSerializer):
 class PhotoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Photo
-        fields = 'id', 'image',
+        fields = 'id', 'image', 'thumbnail', 'card', 'full', 'status'
+        read_only_fields = 'thumbnail', 'card', 'full', 'status'
+
+
+class PhotoUploadSerializer(serializers.ModelSerializer):
+    # the image is only decoded by backend.tasks, outside of the request
+    image = serializers.FileField()
+
+    class Meta:
+        model = Photo
+        fields = 'image',
+
+    def create(self, validated_data):
+        upload = validated_data.pop('image')
+        photo = Photo(status=Photo.PENDING, **validated_data)
+        # staged uploads are not content addressed, see backend.storage
+        photo.image.name = default_storage.save(get_staging_path(photo, upload.name), upload)
+        photo.save()
+        return photo
 
 
 class LoverSerializer(serializers.ModelSerializer):
@@ -34,15 +57,105 @@ class LoverSerializer(serializers.ModelSerializer):
     # target_gender = GenderSerializer()
     # user = UserSerializer()
     photos = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+    cards = serializers.SerializerMethodField()
     age = serializers.SerializerMethodField()
 
     class Meta:
         model = Lover
-        fields = 'id', 'name', 'description', 'birth_date', 'gender', 'city', 'target_gender', 'age_min', 'age_max', 'photos', 'age'
+        fields = 'id', 'name', 'description', 'birth_date', 'gender', 'city', 'target_gender', 'age_min', 'age_max', \
+            'search_radius', 'photos', 'thumbnails', 'cards', 'age'
 
     def get_age(self, obj: Lover):
-        return obj.get_age()
+        # the context is shared by every row of a list, so today is only computed once
+        return obj.get_age(self.context.setdefault('today', datetime.today()))
+
+    def get_photo_data(self, obj: Lover):
+        # .all() goes through prefetch_related('photos') when the list was prefetched
+        if not hasattr(obj, '_photo_data'):
+            photos = [x for x in obj.photos.all() if x.status == Photo.READY]
+            obj._photo_data = PhotoSerializer(photos, many=True).data
+        return obj._photo_data
 
     def get_photos(self, obj: Lover):
-        return [x.get('image') for x in PhotoSerializer(obj.photos, many=True).data]
+        return [x.get('image') for x in self.get_photo_data(obj)]
+
+    def get_thumbnails(self, obj: Lover):
+        # photos uploaded before the resized versions existed fall back to the original
+        return [x.get('thumbnail') or x.get('image') for x in self.get_photo_data(obj)]
+
+    def get_cards(self, obj: Lover):
+        return [x.get('card') or x.get('image') for x in self.get_photo_data(obj)]
+
+
+LOVER_LIST_FIELDS = 'id', 'name', 'description', 'birth_date', 'gender_id', 'city_id', 'target_gender_id', \
+    'age_min', 'age_max', 'search_radius'
+
+
+def with_age(queryset, today):
+    """Annotate ``age`` on ``queryset``, computed by the database the same way as Lover.get_age."""
+    before_birthday = Case(
+        When(Q(birth_date__month__gt=today.month) | Q(birth_date__month=today.month, birth_date__day__gt=today.day),
+             then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return queryset.annotate(age=Value(today.year, output_field=IntegerField()) - ExtractYear('birth_date')
+                             - before_birthday)
+
+
+def lover_rows(queryset, today=None):
+    """Return ``queryset`` as dicts of the columns serialize_lover_rows needs."""
+    return with_age(queryset, today or datetime.today()).values(*LOVER_LIST_FIELDS, 'age')
+
+
+def get_photo_urls(lover_ids):
+    """Return the urls of the ready photos of ``lover_ids`` by lover id, with one query per 500 lovers."""
+    storage = Photo._meta.get_field('image').storage
+    photos = {}
+    lover_ids = list(lover_ids)
+    for i in range(0, len(lover_ids), 500):
+        rows = Photo.objects.filter(lover_id__in=lover_ids[i:i + 500], status=Photo.READY).order_by('id') \
+            .values_list('lover_id', 'image', 'thumbnail', 'card')
+        for lover_id, image, thumbnail, card in rows:
+            image = storage.url(image) if image else None
+            photos.setdefault(lover_id, []).append((
+                image,
+                storage.url(thumbnail) if thumbnail else image,
+                storage.url(card) if card else image,
+            ))
+    return photos
+
+
+def serialize_lover_rows(rows):
+    """
+    Serialize the rows of lover_rows exactly like LoverSerializer(many=True),
+    without building model instances or serializer fields. Used by the list
+    endpoints, where the serializer dominated the response time.
+    """
+    rows = list(rows)
+    photos = get_photo_urls(x['id'] for x in rows)
+    data = []
+    for row in rows:
+        urls = photos.get(row['id'], ())
+        data.append({
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'birth_date': row['birth_date'].isoformat(),
+            'gender': row['gender_id'],
+            'city': row['city_id'],
+            'target_gender': row['target_gender_id'],
+            'age_min': row['age_min'],
+            'age_max': row['age_max'],
+            'search_radius': row['search_radius'],
+            'photos': [x[0] for x in urls],
+            'thumbnails': [x[1] for x in urls],
+            'cards': [x[2] for x in urls],
+            'age': row['age'],
+        })
+    return data
+
 
+def serialize_lovers(queryset, today=None):
+    return serialize_lover_rows(lover_rows(queryset, today))
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from backend import matching, routers
+from backend.authentication import token_cache
+from backend.geo import city_index
+from backend.metrics import registry
+from backend.models import City, Gender, Lover
+from backend.reference import reference_cache
+
+
+@receiver(post_save, sender=Lover)
+def lover_saved(sender, instance: Lover, **kwargs):
+    if matching.index.loaded:
+        matching.index.update_lover(instance)
+    matching.decks.invalidate(instance.id)
+    matching.decks.update_candidate(instance)
+
+
+@receiver(post_delete, sender=Lover)
+def lover_deleted(sender, instance: Lover, **kwargs):
+    matching.index.remove_lover(instance.id)
+    matching.decks.invalidate(instance.id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance: User, created, **kwargs):
+    if not created:
+        token_cache.invalidate_user(instance.id)
+        matching.refresh_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance: User, **kwargs):
+    token_cache.invalidate_user(instance.id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance: Token, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(m2m_changed, sender=Lover.likes.through)
+@receiver(m2m_changed, sender=Lover.dislikes.through)
+def swipes_changed(sender, instance: Lover, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        if reverse:
+            for lover_id in pk_set:
+                matching.index.add_swipes(lover_id, {instance.id})
+                matching.decks.remove_ids(lover_id, {instance.id})
+        else:
+            matching.index.add_swipes(instance.id, pk_set)
+            matching.decks.remove_ids(instance.id, pk_set)
+    elif action in ('post_remove', 'post_clear'):
+        # a lover may both like and dislike the same profile, rebuild rather than guess
+        matching.index.clear()
+        if not reverse:
+            matching.decks.invalidate(instance.id)
+        elif pk_set is None:
+            matching.decks.clear()
+        else:
+            for lover_id in pk_set:
+                matching.decks.invalidate(lover_id)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def city_changed(sender, **kwargs):
+    reference_cache.bump('cities')
+    city_index.clear()
+
+
+@receiver(post_save, sender=Gender)
+@receiver(post_delete, sender=Gender)
+def gender_changed(sender, **kwargs):
+    reference_cache.bump('genders')
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # pooled wrappers count their own checkouts, most of them do not open a connection
+    if not getattr(connection, 'pooled', False):
+        registry.count_connection(connection.alias, 'checkout')
+        registry.count_connection(connection.alias, 'reconnect')
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block or connection.is_usable():
+            continue
+        # keeps the broken connection out of the pool, the next query reconnects
+        connection.errors_occurred = True
+        connection.close()
+        if not getattr(connection, 'pooled', False):
+            registry.count_connection(connection.alias, 'discard')
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def reset_replica_state(**kwargs):
+    routers.reset()
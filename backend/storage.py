@@ -0,0 +1,61 @@
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'^photos/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+
+
+def hashed_name(digest, extension):
+    return 'photos/%s/%s/%s%s' % (digest[:2], digest[2:4], digest, extension)
+
+
+def content_digest(name):
+    """Return the SHA-256 a stored name was derived from, or None for the names stored before."""
+    match = HASHED_NAME.match(name)
+    return match.group(1) if match else None
+
+
+@deconstructible
+class HashedStorage(FileSystemStorage):
+    """
+    File system storage naming every saved file after the SHA-256 of its
+    content, under photos/. Identical images are stored once, names never
+    collide and a stored file never changes, so it can be cached forever.
+    The directory and name given by ``upload_to`` are ignored, except for the
+    extension, and concurrent saves of the same content store one file.
+    Files opened or deleted by name are not affected.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = hashed_name(digest.hexdigest(), os.path.splitext(name)[1].lower())
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # a file stored under the same name holds the same content
+        return name
+
+    def _save(self, name, content):
+        # written under a temporary name then linked, so that the name only ever holds a complete file
+        partial = super()._save('%s.%s.partial' % (name, uuid.uuid4().hex), content)
+        try:
+            os.link(self.path(partial), self.path(name))
+        except FileExistsError:
+            # stored by a concurrent save of the same content
+            pass
+        finally:
+            os.remove(self.path(partial))
+        return name
+
+
+photo_storage = HashedStorage()
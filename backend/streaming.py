@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from backend.serializers import lover_rows, serialize_lover_rows
+
+
+def iter_chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_lovers(queryset, today=None, chunk_size=None):
+    """
+    Yield the lovers of ``queryset`` serialized by serialize_lover_rows, a
+    list per chunk of ``chunk_size`` rows. Rows are read with iterator(), so
+    only one chunk and its photos are in memory at a time.
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    rows = lover_rows(queryset, today).iterator(chunk_size=chunk_size)
+    for chunk in iter_chunks(rows, chunk_size):
+        yield serialize_lover_rows(chunk)
+
+
+def json_array(chunks):
+    """Yield the JSON of the list made of ``chunks``, one string per chunk."""
+    encoder = DjangoJSONEncoder()
+    separator = '['
+    for chunk in chunks:
+        if chunk:
+            yield separator + ','.join(encoder.encode(x) for x in chunk)
+            separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """Response streaming a JSON list out of an iterable of lists."""
+
+    def __init__(self, chunks, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(json_array(chunks), **kwargs)
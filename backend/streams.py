@@ -0,0 +1,118 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from rest_framework.exceptions import AuthenticationFailed
+
+from backend.authentication import CachedTokenAuthentication
+from backend.events import get_broker
+from backend.models import Lover
+
+STREAM_PATH = '/api/matches/stream'
+
+
+def get_lover_id(key):
+    """Return the id of the lover authenticated by the token ``key``, or None."""
+    close_old_connections()
+    try:
+        user, token = CachedTokenAuthentication().authenticate_credentials(key)
+        return Lover.objects.filter(user=user).values_list('id', flat=True).first()
+    except AuthenticationFailed:
+        return None
+    finally:
+        connection.close()
+
+
+class MatchStream:
+    """
+    ASGI application pushing the matches of a lover as Server-Sent Events on
+    STREAM_PATH, and handing every other request to ``application``.
+
+    The token is read from the Authorization header or, since EventSource
+    cannot set headers, from the ``token`` query parameter. An idle stream
+    only costs a coroutine and a queue, and gets a comment line every
+    MATCH_STREAM_HEARTBEAT seconds so that proxies keep it open.
+    """
+
+    def __init__(self, application=None):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+            await self.stream(scope, receive, send)
+        elif self.application is not None:
+            await self.application(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        else:
+            await self.respond(send, 404, {'detail': 'Not found.'})
+
+    @staticmethod
+    async def respond(send, status, body):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+    @staticmethod
+    def get_token(scope):
+        headers = dict(scope['headers'])
+        auth = headers.get(b'authorization', b'').decode('latin-1')
+        if auth.startswith('Token '):
+            return auth[6:]
+        return parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+    async def authenticate(self, scope):
+        key = self.get_token(scope)
+        if not key:
+            return None
+        return await asyncio.get_event_loop().run_in_executor(None, get_lover_id, key)
+
+    async def stream(self, scope, receive, send):
+        lover_id = await self.authenticate(scope)
+        if lover_id is None:
+            await self.respond(send, 401, {'detail': "Informations d'authentification non fournies."})
+            return
+        broker = get_broker()
+        queue = broker.subscribe(lover_id)
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        next_event = None
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+            while True:
+                next_event = next_event or asyncio.ensure_future(queue.get())
+                done, pending = await asyncio.wait({disconnected, next_event},
+                                                   timeout=settings.MATCH_STREAM_HEARTBEAT,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    break
+                if next_event in done:
+                    event, next_event = next_event.result(), None
+                    body = 'event: %s\ndata: %s\n\n' % (event['type'], json.dumps(event))
+                else:
+                    body = ': ping\n\n'
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+        finally:
+            broker.unsubscribe(lover_id, queue)
+            for task in (disconnected, next_event):
+                if task is not None:
+                    task.cancel()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
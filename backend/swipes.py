@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from backend import matching
+from backend.events import publish_match
+from backend.models import Lover, Match, PendingSwipe
+
+
+def increment(field, lover_ids, by=1):
+    """Add ``by`` to the counter ``field`` of ``lover_ids`` with an UPDATE, safe against concurrent swipes."""
+    if lover_ids:
+        Lover.objects.filter(id__in=lover_ids).update(**{field: F(field) + by})
+
+
+def create_match(lover_id, matched_id):
+    """Store the match between two lovers, once for each side, and notify them once committed."""
+    Match.objects.bulk_create([
+        Match(lover_id=lover_id, matched_id=matched_id),
+        Match(lover_id=matched_id, matched_id=lover_id),
+    ], ignore_conflicts=True)
+    increment('match_count', [lover_id, matched_id])
+    transaction.on_commit(lambda: publish_match(lover_id, matched_id))
+
+
+def lock_lovers(lover_ids):
+    """
+    Lock the rows of ``lover_ids`` until the end of the transaction, so that
+    two lovers liking each other at the same time see each other's like. The
+    rows are locked in id order, swipes between the same lovers cannot deadlock.
+    """
+    list(Lover.objects.select_for_update().filter(id__in=lover_ids).order_by('id').values_list('id', flat=True))
+
+
+def reciprocal_likes(lover: Lover, lover_ids):
+    """Return the ids among ``lover_ids`` of the lovers who like ``lover``, flushed or not."""
+    lover_ids = set(lover_ids) - {lover.id}
+    if not lover_ids:
+        return set()
+    liked_by = set(lover.likers.filter(id__in=lover_ids).values_list('id', flat=True))
+    liked_by |= set(PendingSwipe.objects.filter(target=lover.id, lover_id__in=lover_ids - liked_by, liked=True)
+                    .values_list('lover_id', flat=True))
+    return liked_by
+
+
+def _buffer(lover: Lover, liked_ids, disliked_ids):
+    PendingSwipe.objects.bulk_create(
+        [PendingSwipe(lover_id=lover.id, target_id=x, liked=True) for x in liked_ids] +
+        [PendingSwipe(lover_id=lover.id, target_id=x, liked=False) for x in disliked_ids]
+    )
+    from backend.tasks import start_swipe_flusher
+    start_swipe_flusher()
+
+
+def _new_swipes(lover: Lover, liked_ids, disliked_ids):
+    """Return the liked and disliked ids that ``lover`` did not swipe that way yet, flushed or buffered."""
+    liked_ids -= set(Lover.likes.through.objects.filter(from_lover=lover.id, to_lover__in=liked_ids)
+                     .values_list('to_lover_id', flat=True))
+    disliked_ids -= set(Lover.dislikes.through.objects.filter(from_lover=lover.id, to_lover__in=disliked_ids)
+                        .values_list('to_lover_id', flat=True))
+    if settings.SWIPE_BUFFER:
+        pending = PendingSwipe.objects.filter(lover=lover.id, target__in=liked_ids | disliked_ids)
+        for target_id, liked in pending.values_list('target_id', 'liked'):
+            (liked_ids if liked else disliked_ids).discard(target_id)
+    return liked_ids, disliked_ids
+
+
+def _store(lover: Lover, liked_ids, disliked_ids):
+    """
+    Record swipes of ``lover`` and count them on the swiped lovers. Return the
+    liked and disliked ids that were not recorded yet, the others are skipped.
+    """
+    liked_ids, disliked_ids = _new_swipes(lover, set(liked_ids), set(disliked_ids))
+    if settings.SWIPE_BUFFER:
+        _buffer(lover, liked_ids, disliked_ids)
+    else:
+        Lover.likes.through.objects.bulk_create([
+            Lover.likes.through(from_lover_id=lover.id, to_lover_id=x) for x in liked_ids
+        ], ignore_conflicts=True)
+        Lover.dislikes.through.objects.bulk_create([
+            Lover.dislikes.through(from_lover_id=lover.id, to_lover_id=x) for x in disliked_ids
+        ], ignore_conflicts=True)
+    # neither bulk inserts nor the buffer send m2m_changed
+    matching.index.add_swipes(lover.id, liked_ids | disliked_ids)
+    matching.decks.remove_ids(lover.id, liked_ids | disliked_ids)
+    increment('like_count', liked_ids)
+    increment('dislike_count', disliked_ids)
+    return liked_ids, disliked_ids
+
+
+def like(lover: Lover, lover_id) -> bool:
+    """Record that ``lover`` likes ``lover_id`` and return whether it is a match."""
+    with transaction.atomic():
+        lock_lovers([lover.id, lover_id])
+        liked_ids, _ = _store(lover, [lover_id], [])
+        match = bool(reciprocal_likes(lover, [lover_id]))
+        # liking again does not create the match again
+        if match and liked_ids and not Match.objects.filter(lover=lover.id, matched=lover_id).exists():
+            create_match(lover.id, lover_id)
+    return match
+
+
+def dislike(lover: Lover, lover_id):
+    with transaction.atomic():
+        _store(lover, [], [lover_id])
+
+
+def record_swipes(lover: Lover, liked_ids, disliked_ids):
+    """
+    Record a batch of swipes of ``lover`` with one insert per through table and
+    return the ids of the lovers it newly matches with. Swipes already
+    recorded and lovers that no longer exist are ignored.
+    """
+    liked_ids, disliked_ids = set(liked_ids), set(disliked_ids)
+    existing = set(Lover.objects.filter(id__in=liked_ids | disliked_ids).values_list('id', flat=True))
+    liked_ids &= existing
+    disliked_ids &= existing
+    with transaction.atomic():
+        lock_lovers({lover.id} | liked_ids | disliked_ids)
+        _store(lover, liked_ids, disliked_ids)
+        reciprocal = reciprocal_likes(lover, liked_ids)
+        matched_ids = reciprocal - set(
+            Match.objects.filter(lover=lover, matched_id__in=reciprocal).values_list('matched_id', flat=True))
+        Match.objects.bulk_create([Match(lover_id=lover.id, matched_id=x) for x in matched_ids] +
+                                  [Match(lover_id=x, matched_id=lover.id) for x in matched_ids],
+                                  ignore_conflicts=True)
+        if matched_ids:
+            increment('match_count', [lover.id], len(matched_ids))
+            increment('match_count', matched_ids)
+        for matched_id in matched_ids:
+            transaction.on_commit(lambda matched_id=matched_id: publish_match(lover.id, matched_id))
+    return sorted(matched_ids)
+
+
+def flush_swipes(batch_size=None) -> int:
+    """
+    Move the oldest buffered swipes to the likes and dislikes tables and
+    return how many were moved. Flushes running concurrently are safe, they
+    insert with ignore_conflicts and delete the rows they read by id.
+    """
+    batch_size = batch_size or settings.SWIPE_FLUSH_BATCH_SIZE
+    with transaction.atomic():
+        rows = list(PendingSwipe.objects.order_by('id').values_list('id', 'lover_id', 'target_id', 'liked')
+                    [:batch_size])
+        if not rows:
+            return 0
+        Lover.likes.through.objects.bulk_create([
+            Lover.likes.through(from_lover_id=lover_id, to_lover_id=target_id)
+            for _, lover_id, target_id, liked in rows if liked
+        ], ignore_conflicts=True)
+        Lover.dislikes.through.objects.bulk_create([
+            Lover.dislikes.through(from_lover_id=lover_id, to_lover_id=target_id)
+            for _, lover_id, target_id, liked in rows if not liked
+        ], ignore_conflicts=True)
+        PendingSwipe.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from backend.images import process_upload
+from backend.models import Photo
+from backend.storage import content_digest
+from backend.swipes import flush_swipes
+
+logger = logging.getLogger('backend.tasks')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PHOTO_WORKERS, thread_name_prefix='photos')
+        return _executor
+
+
+def process_photo(photo_id) -> bool:
+    """
+    Process a pending photo. The photo is claimed with a conditional update so
+    that a worker thread and the process_photos command never process the same
+    photo twice. Return whether the photo was claimed.
+    """
+    if not Photo.objects.filter(id=photo_id, status=Photo.PENDING).update(status=Photo.PROCESSING):
+        return False
+    photo = Photo.objects.get(id=photo_id)
+    try:
+        process_upload(photo)
+        photo.status = Photo.READY
+    except Exception:
+        logger.exception('Could not process photo %s', photo_id)
+        # a stored original may be shared with other photos, only the staged upload is ours
+        if content_digest(photo.image.name) is None:
+            photo.image.storage.delete(photo.image.name)
+        photo.status = Photo.FAILED
+    photo.save(update_fields=['image', 'status'])
+    return True
+
+
+def _run(photo_id):
+    close_old_connections()
+    try:
+        process_photo(photo_id)
+    except Exception:
+        logger.exception('Photo task %s failed', photo_id)
+    finally:
+        connection.close()
+
+
+def enqueue_photo(photo: Photo):
+    """
+    Process ``photo`` in the worker pool once the current transaction is
+    committed, or right away when PHOTO_WORKERS is 0.
+    """
+    if settings.PHOTO_WORKERS <= 0:
+        process_photo(photo.id)
+        photo.refresh_from_db()
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run, photo.id))
+
+
+_flusher = None
+
+
+def _flush_swipes_forever():
+    while True:
+        time.sleep(settings.SWIPE_FLUSH_INTERVAL)
+        close_old_connections()
+        try:
+            while flush_swipes():
+                pass
+        except Exception:
+            logger.exception('Could not flush the buffered swipes')
+        finally:
+            connection.close()
+
+
+def start_swipe_flusher():
+    """
+    Start the thread flushing the buffered swipes of this process every
+    SWIPE_FLUSH_INTERVAL seconds, unless the interval is 0 and the
+    flush_swipes command is run instead.
+    """
+    global _flusher
+    if settings.SWIPE_FLUSH_INTERVAL <= 0:
+        return
+    with _executor_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_swipes_forever, name='swipes', daemon=True)
+            _flusher.start()
@@ -1,3 +1,832 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from datetime import date, datetime
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.utils import OperationalError
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from backend.db.pool import ConnectionPool
+from backend.events import UnixSocketBroker, get_broker, publish_match
+from backend.geo import city_index
+from backend.matching import DeckCache, candidate_queryset, decks, index
+from backend.metrics import registry
+from backend.models import City, Gender, Lover, Match, PendingSwipe, Photo
+from backend import ranking, swipes
+from backend.reference import reference_cache
+from backend.routers import ReplicaMiddleware, ReplicaRouter, check_pin_cache, is_pinned, pin, pin_key, replica
+from backend.serializers import LoverSerializer, serialize_lovers
+from backend.storage import hashed_name, photo_storage
+from backend.streams import STREAM_PATH, MatchStream
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class LoverTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        # ids are reused once the transaction of the previous test is rolled back
+        decks.clear()
+        index.clear()
+        city_index.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.male = Gender.objects.create(code='M', label='Homme')
+        cls.female = Gender.objects.create(code='F', label='Femme')
+        cls.paris = City.objects.create(name='Paris')
+
+    @classmethod
+    def create_lover(cls, username, gender, target_gender, birth_date=date(1990, 5, 17), city=None, **kwargs):
+        user = User.objects.create(username=username, email='%s@lovocco.fr' % username)
+        return Lover.objects.create(
+            user=user,
+            name=username,
+            gender=gender,
+            target_gender=target_gender,
+            city=city or cls.paris,
+            birth_date=birth_date,
+            **kwargs
+        )
+
+    def authenticate(self, lover: Lover):
+        token, created = Token.objects.get_or_create(user=lover.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Token %s' % token.key
+
+    def get_streamed(self, url):
+        return json.loads(b''.join(self.client.get(url).streaming_content))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+
+class ListQueryCountTest(LoverTestCase):
+
+    def add_candidates(self, count):
+        for i in range(count):
+            candidate = self.create_lover('candidate%d' % len(Lover.objects.all()), self.female, self.male)
+            for j in range(2):
+                Photo.objects.create(lover=candidate, image=SimpleUploadedFile('%d.jpg' % j, b''))
+            yield candidate
+
+    def test_candidates_query_count_does_not_depend_on_size(self):
+        self.authenticate(self.create_lover('me', self.male, self.female))
+        list(self.add_candidates(1))
+        self.count_queries('/api/lovers/candidates')
+        queries = self.count_queries('/api/lovers/candidates')
+        list(self.add_candidates(9))
+        self.assertEqual(self.count_queries('/api/lovers/candidates'), queries)
+
+    def test_matches_query_count_does_not_depend_on_size(self):
+        me = self.create_lover('me', self.male, self.female)
+        self.authenticate(me)
+        for candidate in self.add_candidates(1):
+            Match.objects.create(lover=me, matched=candidate)
+        self.count_queries('/api/matches')
+        queries = self.count_queries('/api/matches')
+        for candidate in self.add_candidates(9):
+            Match.objects.create(lover=me, matched=candidate)
+        self.assertEqual(self.count_queries('/api/matches'), queries)
+
+
+class LoverListSerializationTest(LoverTestCase):
+
+    def test_matches_lover_serializer(self):
+        today = datetime(2024, 2, 28, 12)
+        for i, birth_date in enumerate([date(1990, 2, 27), date(1990, 2, 28), date(1992, 2, 29), date(1995, 12, 31)]):
+            self.create_lover('lover%d' % i, self.female, self.male, birth_date=birth_date, description='Bonjour')
+        lover = Lover.objects.first()
+        Photo.objects.create(lover=lover, image=SimpleUploadedFile('a.jpg', b''),
+                             thumbnail=SimpleUploadedFile('a_thumbnail.jpg', b''))
+        Photo.objects.create(lover=lover, image=SimpleUploadedFile('b.jpg', b''))
+        Photo.objects.create(lover=lover, image=SimpleUploadedFile('c.jpg', b''), status=Photo.PENDING)
+        queryset = Lover.objects.order_by('id')
+        expected = LoverSerializer(queryset, many=True, context={'today': today}).data
+        self.assertEqual(serialize_lovers(queryset, today), json.loads(json.dumps(expected)))
+        self.assertEqual([x['age'] for x in expected], [34, 34, 31, 28])
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_matches_are_streamed(self):
+        me = self.create_lover('me', self.male, self.female)
+        self.authenticate(me)
+        for i in range(5):
+            Match.objects.create(lover=me, matched=self.create_lover('lover%d' % i, self.female, self.male))
+        self.assertEqual(self.get_streamed('/api/matches'),
+                         serialize_lovers(Lover.objects.filter(matched_by__lover=me).order_by('id')))
+        Match.objects.all().delete()
+        self.assertEqual(self.get_streamed('/api/matches'), [])
+
+
+class AuthenticationTest(LoverTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.me = self.create_lover('me', self.male, self.female)
+        self.authenticate(self.me)
+
+    def test_token_is_resolved_once(self):
+        first = self.count_queries('/api/lovers/me')
+        self.assertEqual(self.count_queries('/api/lovers/me'), first - 1)
+
+    def test_deleted_token_is_rejected(self):
+        self.count_queries('/api/lovers/me')
+        Token.objects.filter(user=self.me.user).delete()
+        self.assertEqual(self.client.get('/api/lovers/me').status_code, 401)
+
+    def test_inactive_user_is_rejected(self):
+        self.count_queries('/api/lovers/me')
+        self.me.user.is_active = False
+        self.me.user.save()
+        self.assertEqual(self.client.get('/api/lovers/me').status_code, 401)
+
+
+class ReferenceDataTest(LoverTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reference_cache.bump('cities')
+
+    def test_cities_are_served_from_cache(self):
+        response = self.client.get('/api/citys')
+        self.assertEqual(response.json(), [{'id': self.paris.id, 'name': 'Paris', 'latitude': None, 'longitude': None}])
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.count_queries('/api/citys'), 0)
+
+    def test_current_etag_gets_not_modified(self):
+        etag = self.client.get('/api/citys')['ETag']
+        response = self.client.get('/api/citys', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_saving_a_city_changes_the_etag(self):
+        etag = self.client.get('/api/citys')['ETag']
+        City.objects.create(name='Lyon')
+        response = self.client.get('/api/citys', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+
+@override_settings(PHOTO_WORKERS=0)
+class PhotoTest(LoverTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.me = self.create_lover('me', self.male, self.female)
+        self.authenticate(self.me)
+
+    def upload(self, width, height):
+        content = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(content, 'JPEG')
+        image = SimpleUploadedFile('photo.jpg', content.getvalue(), content_type='image/jpeg')
+        return self.client.post('/api/photos', {'image': image})
+
+    def test_upload_creates_resized_versions(self):
+        response = self.upload(2000, 1000)
+        self.assertEqual(response.status_code, 202)
+        photo = Photo.objects.get(lover=self.me)
+        self.assertEqual(self.client.get('/api/photos/%d' % photo.id).json()['status'], Photo.READY)
+        self.assertTrue(photo.image.name.startswith('photos/'))
+        for field, size in [('thumbnail', 200), ('card', 640), ('full', 1600)]:
+            with Image.open(getattr(photo, field).path) as image:
+                self.assertEqual(image.size, (size, size // 2))
+        profile = self.client.get('/api/lovers/me').json()
+        self.assertEqual(profile['thumbnails'], [photo.thumbnail.url])
+        self.assertEqual(profile['photos'], [photo.image.url])
+
+    def test_invalid_upload_fails(self):
+        upload = SimpleUploadedFile('photo.jpg', b'not an image', content_type='image/jpeg')
+        photo_id = self.client.post('/api/photos', {'image': upload}).json()['id']
+        self.assertEqual(self.client.get('/api/photos/%d' % photo_id).json()['status'], Photo.FAILED)
+        self.assertEqual(self.client.get('/api/lovers/me').json()['photos'], [])
+
+    def test_identical_photos_are_stored_once(self):
+        self.upload(800, 600)
+        self.upload(800, 600)
+        first, second = Photo.objects.filter(lover=self.me).order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.thumbnail.name, second.thumbnail.name)
+        self.assertRegex(first.image.name, r'^photos/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+
+    def test_concurrent_saves_store_one_file(self):
+        name = hashed_name(hashlib.sha256(b'photo').hexdigest(), '.jpg')
+        # both saves passed the exists() check before either wrote the file
+        for i in range(2):
+            self.assertEqual(photo_storage._save(name, ContentFile(b'photo')), name)
+        self.assertEqual(os.listdir(os.path.dirname(photo_storage.path(name))), [os.path.basename(name)])
+        with photo_storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'photo')
+
+    def test_photos_are_served_with_immutable_caching(self):
+        self.upload(800, 600)
+        photo = Photo.objects.get(lover=self.me)
+        response = self.client.get(photo.card.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), photo.card.read())
+        response = self.client.get(photo.card.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get(photo.card.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + photo.card.name)
+        self.assertEqual(response.content, b'')
+
+    def test_only_processed_photos_are_served(self):
+        self.assertEqual(self.client.get('/media/staging/1/photo.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/photos/../../settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/photos/missing.jpg').status_code, 404)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTest(LoverTestCase):
+
+    def get_metrics(self):
+        return self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+
+    def test_requests_are_counted_by_route(self):
+        before = self.get_metrics()
+        self.authenticate(self.create_lover('me', self.male, self.female))
+        self.client.get('/api/photos/123')
+        after = self.get_metrics()
+        line = 'lovocco_requests_total{route="api/photos/<int:photo_id>",method="GET",status="404"} 1'
+        self.assertNotIn(line, before)
+        self.assertIn(line, after)
+        self.assertIn('lovocco_request_queries_bucket{route="api/photos/<int:photo_id>",method="GET",le="+Inf"}', after)
+
+    def test_streamed_responses_are_observed_once_closed(self):
+        def observed():
+            snapshot = registry.snapshot()
+            queries = [x for x in snapshot['histograms']['lovocco_request_queries'] if x[0] == ['api/matches', 'GET']]
+            return queries[0][2:] if queries else [0, 0]
+
+        before = observed()
+        self.authenticate(self.create_lover('me', self.male, self.female))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/matches')
+            self.assertEqual(observed(), before)
+            b''.join(response.streaming_content)
+        self.assertEqual(observed(), [before[0] + len(context.captured_queries), before[1] + 1])
+
+    def test_metrics_require_the_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 401)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/api/metrics').status_code, 404)
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(self.id(), max_size=1, timeout=0.1)
+
+    def count(self, event):
+        return dict((tuple(k), v) for k, v in registry.snapshot()['connections']).get((self.id(), event), 0)
+
+    def test_connections_are_reused(self):
+        first = self.pool.checkout(FakeConnection)
+        self.pool.checkin(first)
+        self.assertIs(self.pool.checkout(FakeConnection), first)
+        self.assertEqual(self.count('reconnect'), 1)
+
+    def test_broken_connections_are_replaced(self):
+        first = self.pool.checkout(FakeConnection)
+        self.pool.checkin(first, reusable=False)
+        self.assertTrue(first.closed)
+        self.assertIsNot(self.pool.checkout(FakeConnection), first)
+
+    def test_idle_connections_are_pinged(self):
+        first = self.pool.checkout(FakeConnection)
+        self.pool.checkin(first)
+        self.pool.ping_idle = 60
+        self.assertIs(self.pool.checkout(FakeConnection, ping=lambda connection: False), first)
+        self.pool.checkin(first)
+        self.pool.ping_idle = 0
+        self.assertIsNot(self.pool.checkout(FakeConnection, ping=lambda connection: False), first)
+        self.assertTrue(first.closed)
+        self.assertEqual(self.count('discard'), 1)
+
+    def test_checkout_waits_for_a_connection(self):
+        first = self.pool.checkout(FakeConnection)
+        with self.assertRaises(OperationalError):
+            self.pool.checkout(FakeConnection)
+        threading.Timer(0.01, self.pool.checkin, (first,)).start()
+        self.pool.timeout = 5
+        self.assertIs(self.pool.checkout(FakeConnection), first)
+        self.assertEqual(self.count('wait'), 2)
+
+
+@override_settings(DB_REPLICAS=['replica0'], CACHES={
+    'replica-pins': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                     'LOCATION': tempfile.mkdtemp()},
+})
+class ReplicaRouterTest(SimpleTestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._overridden_settings['CACHES']['replica-pins']['LOCATION'], ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['replica-pins'].clear()
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Token abc')
+
+    def route(self, view, request):
+        def get_response(request):
+            ReplicaMiddleware(None).process_view(request, view, (), {})
+            return view(request)
+        return ReplicaMiddleware(get_response)(request)
+
+    @staticmethod
+    def read(request):
+        return ReplicaRouter().db_for_read(Lover)
+
+    def test_reads_of_replica_views_go_to_a_replica(self):
+        self.assertEqual(self.route(replica(lambda request: self.read(request)), self.factory.get('/')), 'replica0')
+        self.assertEqual(self.route(self.read, self.factory.get('/')), 'default')
+        self.assertEqual(self.read(None), 'default')
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        self.route(self.read, self.factory.post('/'))
+        self.assertEqual(self.route(replica(lambda request: self.read(request)), self.factory.get('/')), 'default')
+        other = RequestFactory(HTTP_AUTHORIZATION='Token def').get('/')
+        self.assertEqual(self.route(replica(lambda request: self.read(request)), other), 'replica0')
+
+    def test_pins_need_a_shared_cache(self):
+        self.assertEqual(check_pin_cache(None), [])
+        with self.settings(CACHES={'replica-pins': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([x.id for x in check_pin_cache(None)], ['backend.E001'])
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        def write_then_read(request):
+            ReplicaRouter().db_for_write(Lover)
+            return self.read(request)
+        self.assertEqual(self.route(replica(write_then_read), self.factory.get('/')), 'default')
+
+    def test_new_tokens_are_pinned_and_read_from_the_primary(self):
+        pin(RequestFactory().post('/api/register'), 'xyz')
+        self.assertTrue(is_pinned(RequestFactory(HTTP_AUTHORIZATION='Token xyz').get('/')))
+        self.assertEqual(ReplicaRouter().db_for_read(Token), 'default')
+
+    @override_settings(DB_REPLICAS=[])
+    def test_no_pins_without_replicas(self):
+        self.route(self.read, self.factory.post('/'))
+        self.assertFalse(caches['replica-pins'].get(pin_key(self.factory.get('/'))))
+        self.assertEqual(self.route(replica(lambda request: self.read(request)), self.factory.get('/')), 'default')
+
+
+class MatchStreamTest(SimpleTestCase):
+
+    class Stream(MatchStream):
+        async def authenticate(self, scope):
+            return 1 if scope['headers'] else None
+
+    def run_stream(self, headers):
+        sent = []
+
+        async def scenario():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                body = message.get('body', b'')
+                if body.startswith(b': connected'):
+                    publish_match(1, 2)
+                elif body.startswith(b'event:'):
+                    disconnected.set()
+
+            scope = {'type': 'http', 'path': STREAM_PATH, 'headers': headers}
+            await asyncio.wait_for(self.Stream()(scope, receive, send), 5)
+
+        asyncio.run(scenario())
+        return sent
+
+    def test_match_is_pushed(self):
+        sent = self.run_stream([(b'authorization', b'Token key')])
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[-1]['body'], b'event: match\ndata: {"type": "match", "lover": 2}\n\n')
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    def test_stream_requires_a_token(self):
+        self.assertEqual(self.run_stream([])[0]['status'], 401)
+
+    def test_events_reach_the_streams_of_other_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # the socket of a process that is gone
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as gone:
+            gone.bind(os.path.join(directory, '1.sock'))
+        streams, api = UnixSocketBroker(directory), UnixSocketBroker(directory)
+        self.addCleanup(streams.close)
+
+        async def scenario():
+            queue = streams.subscribe(7)
+            # the API process shares nothing with the stream process but the directory
+            await asyncio.get_event_loop().run_in_executor(None, api.publish, 7, {'type': 'match', 'lover': 8})
+            return await asyncio.wait_for(queue.get(), 5)
+
+        self.assertEqual(asyncio.run(scenario()), {'type': 'match', 'lover': 8})
+        self.assertEqual(os.listdir(directory), ['%d.sock' % os.getpid()])
+
+
+class RegistrationTest(LoverTestCase):
+
+    def register(self, **data):
+        body = {'username': 'Jean Dupont', 'name': 'Jean', 'gender': self.male.id, 'email': 'jean@lovocco.fr',
+                'password': 'motdepasse', 'birthdate': '1990-05-17', 'city': self.paris.id}
+        body.update(data)
+        return self.client.post('/api/register', json.dumps(body), content_type='application/json')
+
+    def test_register_creates_user_lover_and_token(self):
+        response = self.register()
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(username='jeandupont')
+        self.assertTrue(user.check_password('motdepasse'))
+        self.assertEqual(user.last_name, '')
+        self.assertEqual(Token.objects.get(user=user).key, response.json()['token'])
+        lover = user.lover
+        self.assertEqual((lover.gender, lover.target_gender, lover.city), (self.male, self.female, self.paris))
+        self.assertEqual(lover.birth_date, date(1990, 5, 17))
+
+    def test_register_rejects_taken_username_and_email(self):
+        self.register()
+        self.assertIn('username', self.register(email='autre@lovocco.fr').json())
+        self.assertIn('email', self.register(username='autre').json())
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_register_rejects_invalid_gender_city_and_birthdate(self):
+        self.assertIn('gender', self.register(gender=999).json())
+        self.assertIn('city', self.register(city=999).json())
+        self.assertIn('birthdate', self.register(birthdate='17/05/1990').json())
+        self.assertFalse(User.objects.exists())
+
+
+class CandidatesTest(LoverTestCase):
+
+    def test_liked_and_disliked_lovers_are_excluded(self):
+        me = self.create_lover('me', self.male, self.female)
+        liked, disliked, candidate = [self.create_lover(x, self.female, self.male) for x in ('a', 'b', 'c')]
+        me.likes.add(liked)
+        me.dislikes.add(disliked)
+        liked.likes.add(candidate)
+        self.authenticate(me)
+        self.assertEqual([x['id'] for x in self.client.get('/api/lovers/candidates').json()], [candidate.id])
+
+    def get_candidate_ids(self):
+        return [x['id'] for x in self.client.get('/api/lovers/candidates').json()]
+
+    def test_index_follows_saves_and_swipes(self):
+        me = self.create_lover('me', self.male, self.female)
+        lovers = [self.create_lover(str(i), self.female, self.male) for i in range(4)]
+        self.create_lover('old', self.female, self.male, birth_date=date(1950, 1, 1))
+
+        def assert_index_matches_queryset():
+            self.assertEqual(sorted(index.candidate_ids(me)),
+                             sorted(candidate_queryset(me).values_list('id', flat=True)))
+
+        assert_index_matches_queryset()
+        me.likes.add(lovers[0])
+        me.dislikes.add(lovers[1])
+        assert_index_matches_queryset()
+        lovers[2].age_min, lovers[2].age_max = '18', '20'
+        lovers[2].save()
+        self.create_lover('new', self.female, self.male)
+        assert_index_matches_queryset()
+        lovers[3].user.is_active = False
+        lovers[3].user.save()
+        assert_index_matches_queryset()
+        self.assertEqual(len(index.candidate_ids(me)), 1)
+
+    def test_deck_is_updated_by_swipes_and_newcomers(self):
+        me = self.create_lover('me', self.male, self.female)
+        liked, candidate = [self.create_lover(x, self.female, self.male) for x in ('a', 'b')]
+        self.authenticate(me)
+        self.assertEqual(self.get_candidate_ids(), [liked.id, candidate.id])
+        self.client.post('/api/lovers/%d/like' % liked.id)
+        newcomer = self.create_lover('c', self.female, self.male)
+        self.create_lover('d', self.female, self.male, birth_date=date(1950, 1, 1))
+        self.assertEqual(decks.page_ids(me), [candidate.id, newcomer.id])
+        self.assertEqual(self.get_candidate_ids(), [candidate.id, newcomer.id])
+
+    def test_newcomers_only_visit_the_decks_looking_for_them(self):
+        me = self.create_lover('me', self.male, self.female)
+        him = self.create_lover('him', self.male, self.male)
+        cache = DeckCache(max_size=2, ttl=60)
+        cache.set(me, [])
+        cache.set(him, [])
+        self.assertEqual(cache._owners, {(self.male.id, self.female.id): {me.id},
+                                         (self.male.id, self.male.id): {him.id}})
+        newcomer = self.create_lover('a', self.female, self.male)
+        cache.update_candidate(newcomer)
+        self.assertEqual((cache.page_ids(me), cache.page_ids(him)), ([newcomer.id], []))
+        # evicting or invalidating a deck takes its owner out of the buckets
+        cache.set(newcomer, [])
+        cache.invalidate(him.id)
+        self.assertEqual(cache._owners, {(self.male.id, self.female.id): set(), (self.male.id, self.male.id): set(),
+                                         (self.female.id, self.male.id): {newcomer.id}})
+        cache.update_candidate(self.create_lover('b', self.female, self.male))
+
+    def page_candidate_ids(self, limit):
+        ids, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get('/api/lovers/candidates', {'limit': limit, 'cursor': cursor})
+            ids += [x['id'] for x in response.json()]
+            cursor = response.get('X-Next-Cursor')
+        return ids
+
+    def test_stale_candidates_do_not_end_the_deck(self):
+        me = self.create_lover('me', self.male, self.female)
+        self.authenticate(me)
+        candidates = [self.create_lover(str(i), self.female, self.male) for i in range(7)]
+        for deck_size, use_index in ((10000, False), (0, True)):
+            decks.clear()
+            with self.subTest(use_index=use_index), \
+                    self.settings(DECK_CACHE_SIZE=deck_size, MATCHING_USE_INDEX=use_index):
+                response = self.client.get('/api/lovers/candidates', {'limit': 2})
+                self.assertEqual([x['id'] for x in response.json()], [x.id for x in candidates[:2]])
+                candidates[2].age_max = 20
+                candidates[2].save()
+                # written by another worker, which neither the deck nor the index heard of
+                Lover.objects.filter(id=candidates[3].id).update(age_max=20)
+                cursor = response['X-Next-Cursor']
+                ids = []
+                while cursor is not None:
+                    response = self.client.get('/api/lovers/candidates', {'limit': 2, 'cursor': cursor})
+                    ids += [x['id'] for x in response.json()]
+                    cursor = response.get('X-Next-Cursor')
+                self.assertEqual(ids, [x.id for x in candidates[4:]])
+                if not use_index:
+                    self.assertNotIn(candidates[3].id, decks.page_ids(me))
+                Lover.objects.filter(id__in=[candidates[2].id, candidates[3].id]).update(age_max=60)
+        decks.clear()
+        self.assertEqual(self.page_candidate_ids(2), [x.id for x in candidates])
+
+    def test_saved_lovers_leave_the_decks_they_no_longer_fit(self):
+        me = self.create_lover('me', self.male, self.female)
+        liked, candidate = [self.create_lover(x, self.female, self.male) for x in ('a', 'b')]
+        self.authenticate(me)
+        self.client.post('/api/lovers/%d/like' % liked.id)
+        self.assertEqual(self.page_candidate_ids(1), [candidate.id])
+        liked.save()
+        candidate.user.is_active = False
+        candidate.user.save()
+        self.assertEqual(decks.page_ids(me), [])
+        candidate.user.is_active = True
+        candidate.user.save()
+        self.assertEqual(decks.page_ids(me), [candidate.id])
+
+    def test_search_radius_includes_nearby_cities(self):
+        paris = City.objects.create(name='Paris', latitude=48.8566, longitude=2.3522)
+        versailles = City.objects.create(name='Versailles', latitude=48.8049, longitude=2.1204)
+        lyon = City.objects.create(name='Lyon', latitude=45.764, longitude=4.8357)
+        me = self.create_lover('me', self.male, self.female, city=versailles, search_radius=30)
+        self.authenticate(me)
+        near, far = self.create_lover('a', self.female, self.male, city=paris), \
+            self.create_lover('b', self.female, self.male, city=lyon)
+        for use_index in (False, True):
+            decks.clear()
+            with self.subTest(use_index=use_index), self.settings(MATCHING_USE_INDEX=use_index):
+                self.assertEqual(self.get_candidate_ids(), [near.id])
+        newcomer = self.create_lover('c', self.female, self.male, city=paris)
+        self.assertEqual(self.get_candidate_ids(), [near.id, newcomer.id])
+        self.assertEqual(self.client.put('/api/lovers/me', json.dumps({
+            'name': 'me', 'birth_date': '1990-05-17', 'gender': self.male.id, 'city': versailles.id,
+            'target_gender': self.female.id, 'age_min': 18, 'age_max': 60, 'search_radius': 500,
+        }), content_type='application/json').status_code, 400)
+
+    @override_settings(CANDIDATE_RANKING=True)
+    def test_ranked_candidates_are_paginated(self):
+        me = self.create_lover('me', self.male, self.female, age_min=25, age_max=35)
+        birth_dates = [date(date.today().year - x, 1, 1) for x in (31, 27, 34, 29, 29)]
+        candidates = [self.create_lover(str(i), self.female, self.male, birth_date=x)
+                      for i, x in enumerate(birth_dates)]
+        candidates[0].likers.add(candidates[1])
+        self.authenticate(me)
+        features = ranking.candidate_features(me)
+        python_scores = ranking.score_python(me, features)
+        for python_score, numpy_score in zip(python_scores, ranking.score_numpy(me, features)):
+            self.assertAlmostEqual(python_score, numpy_score)
+        expected = [x for _, x in sorted(zip(python_scores, features['id']), key=lambda x: (-x[0], x[1]))]
+        self.assertEqual(sorted(expected), sorted(x.id for x in candidates))
+        for deck_size in (10000, 0):
+            with self.subTest(deck_size=deck_size), self.settings(DECK_CACHE_SIZE=deck_size):
+                self.assertEqual(self.page_candidate_ids(2), expected)
+        # past the limit, only the newest candidates are ranked
+        self.assertEqual(sorted(ranking.candidate_features(me, limit=2)['id']), [x.id for x in candidates[-2:]])
+
+    @override_settings(CANDIDATE_RANKING=True)
+    def test_ranked_deck_skips_swiped_candidates(self):
+        me = self.create_lover('me', self.male, self.female)
+        candidates = [self.create_lover(str(i), self.female, self.male) for i in range(5)]
+        self.authenticate(me)
+        response = self.client.get('/api/lovers/candidates', {'limit': 2})
+        first_page = [x['id'] for x in response.json()]
+        swiped = [x.id for x in candidates if x.id not in first_page]
+        self.client.post('/api/lovers/%d/dislike' % swiped[0])
+        # swiped by another worker, which the deck did not hear of
+        me.likes.through.objects.bulk_create([me.likes.through(from_lover=me, to_lover_id=swiped[1])])
+        response = self.client.get('/api/lovers/candidates', {'limit': 2, 'cursor': response['X-Next-Cursor']})
+        self.assertEqual([x['id'] for x in response.json()], swiped[2:])
+        self.assertNotIn('X-Next-Cursor', response)
+
+    def test_profile_change_rebuilds_the_deck(self):
+        me = self.create_lover('me', self.male, self.female)
+        candidate = self.create_lover('a', self.female, self.male)
+        self.authenticate(me)
+        self.assertEqual(self.get_candidate_ids(), [candidate.id])
+        me.city = City.objects.create(name='Lyon')
+        me.save()
+        self.assertEqual(self.get_candidate_ids(), [])
+
+
+class MatchTest(LoverTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.me = self.create_lover('me', self.male, self.female)
+        self.her = self.create_lover('her', self.female, self.male)
+
+    def test_mutual_like_creates_match(self):
+        self.authenticate(self.me)
+        self.assertFalse(self.client.post('/api/lovers/%d/like' % self.her.id).json()['match'])
+        self.assertFalse(Match.objects.exists())
+        self.authenticate(self.her)
+        self.assertTrue(self.client.post('/api/lovers/%d/like' % self.me.id).json()['match'])
+        self.assertEqual([x['id'] for x in self.get_streamed('/api/matches')], [self.me.id])
+        self.authenticate(self.me)
+        self.assertEqual([x['id'] for x in self.get_streamed('/api/matches')], [self.her.id])
+
+    def test_batch_swipes(self):
+        other = self.create_lover('other', self.female, self.male)
+        self.her.likes.add(self.me)
+        self.authenticate(self.me)
+        swipes = [{'lover': self.her.id, 'action': 'like'}, {'lover': other.id, 'action': 'dislike'},
+                  {'lover': 999999, 'action': 'like'}]
+        response = self.client.post('/api/swipes', json.dumps({'swipes': swipes}), content_type='application/json')
+        self.assertEqual(response.json(), {'matches': [self.her.id]})
+        self.assertEqual(list(self.me.likes.all()), [self.her])
+        self.assertEqual(list(self.me.dislikes.all()), [other])
+        self.assertEqual(Match.objects.count(), 2)
+        # sending the same batch again creates nothing
+        response = self.client.post('/api/swipes', json.dumps({'swipes': swipes}), content_type='application/json')
+        self.assertEqual(response.json(), {'matches': []})
+
+    def test_batch_swipes_rejects_invalid_swipes(self):
+        self.authenticate(self.me)
+        for swipes in ([{'lover': self.her.id, 'action': 'superlike'}], [{'lover': True, 'action': 'like'}],
+                       [{'lover': self.her.id, 'action': 'like'}, {'lover': self.her.id, 'action': 'dislike'}]):
+            with self.subTest(swipes=swipes):
+                response = self.client.post('/api/swipes', json.dumps({'swipes': swipes}),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.me.likes.exists())
+        self.assertFalse(self.me.dislikes.exists())
+
+    @override_settings(SWIPE_BUFFER=True, SWIPE_FLUSH_INTERVAL=0)
+    def test_buffered_swipes(self):
+        other = self.create_lover('other', self.female, self.male)
+        self.authenticate(self.me)
+        self.assertFalse(self.client.post('/api/lovers/%d/like' % self.her.id).json()['match'])
+        self.client.post('/api/lovers/%d/dislike' % other.id)
+        self.assertEqual(self.client.get('/api/lovers/candidates').json(), [])
+        self.authenticate(self.her)
+        # the reciprocal like is still in the buffer
+        self.assertTrue(self.client.post('/api/lovers/%d/like' % self.me.id).json()['match'])
+        self.assertFalse(self.me.likes.exists())
+        # liking again neither buffers the swipe nor creates the match again
+        self.client.post('/api/lovers/%d/like' % self.me.id)
+        self.assertEqual(PendingSwipe.objects.count(), 3)
+        self.assertEqual(Match.objects.count(), 2)
+        call_command('flush_swipes', stdout=StringIO())
+        self.assertFalse(PendingSwipe.objects.exists())
+        self.assertEqual(list(self.me.likes.all()), [self.her])
+        self.assertEqual(list(self.me.dislikes.all()), [other])
+        self.assertEqual(list(self.her.likes.all()), [self.me])
+
+    def test_swipes_are_counted(self):
+        other = self.create_lover('other', self.male, self.female)
+        self.authenticate(self.me)
+        self.client.post('/api/lovers/%d/like' % self.her.id)
+        self.client.post('/api/lovers/%d/like' % self.her.id)
+        self.authenticate(self.her)
+        self.client.post('/api/swipes', json.dumps({'swipes': [
+            {'lover': self.me.id, 'action': 'like'}, {'lover': other.id, 'action': 'dislike'},
+        ]}), content_type='application/json')
+        counters = list(Lover.objects.order_by('id').values_list('like_count', 'dislike_count', 'match_count'))
+        self.assertEqual(counters, [(1, 0, 1), (1, 0, 1), (0, 1, 0)])
+        Lover.objects.update(like_count=5, dislike_count=5, match_count=5)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(list(Lover.objects.order_by('id').values_list('like_count', 'dislike_count', 'match_count')),
+                         counters)
+
+    @override_settings(SWIPE_BUFFER=True, SWIPE_FLUSH_INTERVAL=0)
+    def test_buffered_swipes_are_counted_once(self):
+        self.authenticate(self.her)
+        self.client.post('/api/lovers/%d/like' % self.me.id)
+        self.authenticate(self.me)
+        for i in range(3):
+            self.client.post('/api/lovers/%d/like' % self.her.id)
+        counters = list(Lover.objects.order_by('id').values_list('like_count', 'match_count'))
+        self.assertEqual(counters, [(1, 1), (1, 1)])
+        # a swipe flushed by a transaction that has not deleted its buffered row yet
+        self.me.likes.add(self.her)
+        PendingSwipe.objects.create(lover=self.me, target=self.her, liked=True)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(list(Lover.objects.order_by('id').values_list('like_count', 'match_count')), counters)
+
+    def test_swiped_lovers_are_locked_first(self):
+        for swipe in (lambda: swipes.like(self.me, self.her.id),
+                      lambda: swipes.record_swipes(self.her, [self.me.id], [])):
+            with CaptureQueriesContext(connection) as context:
+                swipe()
+            queries = [x['sql'] for x in context.captured_queries]
+            lock = next(i for i, sql in enumerate(queries) if 'ORDER BY "backend_lover"."id"' in sql)
+            self.assertLess(lock, next(i for i, sql in enumerate(queries) if sql.startswith('INSERT')))
+
+    def test_backfill_matches(self):
+        self.me.likes.add(self.her)
+        self.her.likes.add(self.me)
+        self.create_lover('other', self.female, self.male).likes.add(self.me)
+        call_command('backfill_matches', stdout=StringIO())
+        self.assertEqual(
+            sorted(Match.objects.values_list('lover_id', 'matched_id')),
+            sorted([(self.me.id, self.her.id), (self.her.id, self.me.id)])
+        )
+
+
+@unittest.skipUnless(connection.features.has_select_for_update, 'the database cannot lock rows')
+class MatchRaceTest(TransactionTestCase):
+
+    def setUp(self):
+        male = Gender.objects.create(code='M', label='Homme')
+        female = Gender.objects.create(code='F', label='Femme')
+        paris = City.objects.create(name='Paris')
+        self.me, self.her = [
+            Lover.objects.create(user=User.objects.create(username=name), name=name, gender=gender,
+                                 target_gender=target_gender, city=paris, birth_date=date(1990, 5, 17))
+            for name, gender, target_gender in (('me', male, female), ('her', female, male))
+        ]
+
+    def test_simultaneous_likes_match(self):
+        stored, release = threading.Event(), threading.Event()
+        results = {}
+        reciprocal_likes = swipes.reciprocal_likes
+
+        def check(lover, lover_ids):
+            if lover == self.me:
+                stored.set()
+                release.wait(5)
+            return reciprocal_likes(lover, lover_ids)
+
+        def like(lover, other):
+            results[lover.id] = swipes.like(lover, other.id)
+            connection.close()
+
+        with mock.patch.object(swipes, 'reciprocal_likes', check):
+            first = threading.Thread(target=like, args=(self.me, self.her))
+            first.start()
+            stored.wait(5)
+            # her like runs while the like of me is stored but not committed
+            second = threading.Thread(target=like, args=(self.her, self.me))
+            second.start()
+            second.join(0.5)
+            release.set()
+            first.join()
+            second.join()
+        self.assertEqual(sorted(results.values()), [False, True])
+        self.assertEqual(Match.objects.count(), 2)
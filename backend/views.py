@@ -1,64 +1,79 @@
+import hmac
+import mimetypes
+import os
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes, parser_classes
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 
+from backend import swipes
+from backend.authentication import CachedTokenAuthentication
+from backend.matching import get_candidates
+from backend.metrics import registry, render as render_metrics
 from backend.models import Lover, Gender, City, Photo
-from backend.serializers import LoverSerializer, CitySerializer, GenderSerializer, PhotoSerializer
+from backend.pagination import InvalidPageParameter, decode_cursor, decode_rank_cursor, encode_rank_cursor, \
+    get_page_parameters, paginate
+from backend.ranking import ranked_candidates
+from backend.reference import reference_response
+from backend.routers import pin, replica
+from backend.serializers import LoverSerializer, CitySerializer, GenderSerializer, PhotoSerializer, \
+    PhotoUploadSerializer, lover_rows, serialize_lover_rows
+from backend.storage import content_digest
+from backend.streaming import StreamingJsonResponse, iter_lovers
+from backend.tasks import enqueue_photo
 
 
 def get_body(request) -> dict:
     return request.data
 
 
-def get_authenticated_user(request) -> User:
-    headers = request.headers
-    auth = headers.get('Authorization')
-    if auth is not None:
-        if auth.startswith('Token '):
-            token = auth[6:]
-            return Token.objects.get(key=token).user
-        else:
-            raise ValueError('Unknown authentication method')
-    else:
-        raise ValueError('no authentication found')
+def create_lover(user: User, gender: Gender, city_id, birth_date, target_gender: Gender = None) -> Lover:
+    lover = Lover(
+        user=user,
+        name=user.first_name,
+        gender=gender,
+        city_id=city_id,
+        birth_date=birth_date,
+    )
+    if target_gender is None:
+        target_gender = Gender.objects.exclude(id=gender.id).first()
+    lover.target_gender = target_gender
+    age = lover.get_age()
+    lover.age_min = max(age - 3, 18)
+    lover.age_max = age + 3
+    lover.save()
+    return lover
 
 
 def get_or_create_lover(user: User) -> Lover:
     try:
         lover = user.lover
     except Lover.DoesNotExist:
+        # users registered before their lover was created at registration carry it in last_name
         data = user.last_name.split(';')
         gender = Gender.objects.get(pk=int(data[0]))
         city = data[2]
         birth_date = datetime.strptime(data[1], '%Y-%m-%d').date()
-        lover = Lover(
-            user=user,
-            name=user.first_name,
-            gender=gender,
-            city_id=int(city),
-            birth_date=birth_date,
-        )
-        lover.target_gender = Gender.objects.exclude(id=gender.id).first()
-        age = lover.get_age()
-        lover.age_min = max(age - 3, 18)
-        lover.age_max = age + 3
-        lover.save()
+        lover = create_lover(user, gender, int(city), birth_date)
     return lover
 
 
 @api_view(['GET', 'PUT'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 def my_profile(request):
-    user = get_authenticated_user(request)
+    user = request.user
     lover = get_or_create_lover(user)
     if request.method == 'GET':
         return JsonResponse(LoverSerializer(lover).data, safe=False)
@@ -119,6 +134,20 @@ def my_profile(request):
         description = body.get('description')
         age_min = body.get('age_min')
         age_max = body.get('age_max')
+        search_radius = body.get('search_radius')
+        if search_radius in [None, '']:
+            search_radius = None
+        else:
+            try:
+                search_radius = int(search_radius)
+            except (TypeError, ValueError):
+                search_radius = -1
+            if not 0 <= search_radius <= settings.MAX_SEARCH_RADIUS:
+                return JsonResponse(
+                    {"search_radius": "Le rayon de recherche doit être compris entre 0 et %d km"
+                                      % settings.MAX_SEARCH_RADIUS},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
         # update lover
         lover.name = name
@@ -128,9 +157,12 @@ def my_profile(request):
         lover.description = description
         lover.age_min = age_min
         lover.age_max = age_max
+        lover.search_radius = search_radius
         lover.target_gender = target_gender
 
-        lover.save()
+        # the counters are incremented concurrently by the swipes of other lovers
+        lover.save(update_fields=['name', 'birth_date', 'gender', 'city', 'description', 'age_min', 'age_max',
+                                  'search_radius', 'target_gender'])
         return JsonResponse(LoverSerializer(lover).data, safe=False)
 
 
@@ -144,11 +176,6 @@ def register_user(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     username = username.lower().replace(' ', '')
-    if User.objects.filter(username=username).exists():
-        return JsonResponse(
-            {"username": "Ce pseudo n'est pas disponible"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
     name = body.get('name')
     if name in [None, '']:
         return JsonResponse(
@@ -161,22 +188,12 @@ def register_user(request):
             {"gender": "Veuillez indiquer votre sexe"},
             status=status.HTTP_400_BAD_REQUEST
         )
-    elif not Gender.objects.filter(id=gender).exists():
-        return JsonResponse(
-            {"gender": "Le sexe choisi est ambigu"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
     email = body.get('email')
     if email in [None, '']:
         return JsonResponse(
             {"email": "Veuillez saisir une adresse email"},
             status=status.HTTP_400_BAD_REQUEST
         )
-    elif User.objects.filter(email=email).exists():
-        return JsonResponse(
-            {"email": "Cet adresse email est déjà utilisée"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
     password = body.get('password')
     if password in [None, '']:
         return JsonResponse(
@@ -189,15 +206,40 @@ def register_user(request):
             {"birthdate": "Veuillez saisir une date de naissance"},
             status=status.HTTP_400_BAD_REQUEST
         )
+    try:
+        birthdate = datetime.strptime(birthdate, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return JsonResponse(
+            {"birthdate": "Date de naissance invalide"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     city = body.get('city')
     if city in [None, '']:
         return JsonResponse(
             {"city": "Veuillez saisir une ville"},
             status=status.HTTP_400_BAD_REQUEST
         )
-    try:
-        City.objects.get(pk=city)
-    except City.DoesNotExist:
+
+    # one query for both unique fields, one for the genders, one for the city
+    taken = User.objects.filter(Q(username=username) | Q(email=email)).values_list('username', 'email')
+    if any(x[0] == username for x in taken):
+        return JsonResponse(
+            {"username": "Ce pseudo n'est pas disponible"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if taken:
+        return JsonResponse(
+            {"email": "Cet adresse email est déjà utilisée"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    genders = list(Gender.objects.order_by('id'))
+    gender = next((x for x in genders if str(x.id) == str(gender)), None)
+    if gender is None:
+        return JsonResponse(
+            {"gender": "Le sexe choisi est ambigu"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not City.objects.filter(pk=city).exists():
         return JsonResponse(
             {"city": "Ville invalide"},
             status=status.HTTP_400_BAD_REQUEST
@@ -207,83 +249,126 @@ def register_user(request):
         username=username,
         email=email,
         first_name=name,
-        last_name='%s;%s;%s' % (str(gender), birthdate, str(city)),
         is_active=True,
         is_staff=False,
         is_superuser=False
     )
-    user.save()
     user.set_password(password)
-    user.save()
-    get_or_create_lover(user)
-    token, created = Token.objects.get_or_create(user=user)
+    with transaction.atomic():
+        user.save()
+        create_lover(user, gender, int(city), birthdate,
+                     target_gender=next((x for x in genders if x.id != gender.id), None))
+        token = Token.objects.create(user=user)
+    # the client has no token yet for the middleware to pin
+    pin(request, token.key)
     return JsonResponse({'token': token.key}, safe=False)
 
 
 @api_view(['POST'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 def like(request, lover_id):
-    user = get_authenticated_user(request)
+    user = request.user
     lover = get_or_create_lover(user)
-    lover.likes.add(lover_id)
-    match = lover.likers.all().filter(id=lover_id).exists()
+    match = swipes.like(lover, lover_id)
     return JsonResponse({"match": match})
 
 
 @api_view(['POST'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 def dislike(request, lover_id):
-    user = get_authenticated_user(request)
+    user = request.user
     lover = get_or_create_lover(user)
-    lover.dislikes.add(lover_id)
+    swipes.dislike(lover, lover_id)
     return JsonResponse({"status": "ok"})
 
 
+@api_view(['POST'])
+@authentication_classes((CachedTokenAuthentication,))
+@permission_classes((IsAuthenticated,))
+def batch_swipes(request):
+    user = request.user
+    lover = get_or_create_lover(user)
+    body = get_body(request)
+    decisions = body.get('swipes') if isinstance(body, dict) else None
+    if not isinstance(decisions, list):
+        return JsonResponse(
+            {"swipes": "Veuillez envoyer une liste de swipes"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(decisions) > settings.SWIPE_BATCH_SIZE:
+        return JsonResponse(
+            {"swipes": "Pas plus de %d swipes à la fois" % settings.SWIPE_BATCH_SIZE},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    actions = {}
+    for decision in decisions:
+        # bool is an int, true would be taken as the id 1
+        if not isinstance(decision, dict) or type(decision.get('lover')) is not int \
+                or decision.get('action') not in ['like', 'dislike']:
+            return JsonResponse(
+                {"swipes": "Swipe invalide : %s" % decision},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if actions.setdefault(decision['lover'], decision['action']) != decision['action']:
+            return JsonResponse(
+                {"swipes": "Le profil %d est à la fois aimé et rejeté" % decision['lover']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    liked_ids = [x for x, action in actions.items() if action == 'like']
+    disliked_ids = [x for x, action in actions.items() if action == 'dislike']
+    matched_ids = swipes.record_swipes(lover, liked_ids, disliked_ids)
+    return JsonResponse({"matches": matched_ids})
+
+
+@replica
 @api_view(['GET'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 def candidates(request):
-    user = get_authenticated_user(request)
+    user = request.user
     lover = get_or_create_lover(user)
-    today = datetime.today()
-    birthday_min = today - relativedelta(years=lover.age_max)
-    birthday_max = today - relativedelta(years=lover.age_min)
-    age = lover.get_age()
-    possible_candidates = Lover.objects.filter(
-        gender=lover.target_gender,
-        target_gender=lover.gender,
-        city=lover.city,
-        user__is_active=True,
-        birth_date__gte=birthday_min,
-        birth_date__lte=birthday_max,
-        age_min__lte=age,
-        age_max__gte=age,
-    ).exclude(id=lover.id).exclude(id__in=[o.id for o in lover.likes.all()])
-    return JsonResponse(LoverSerializer(possible_candidates, many=True).data, safe=False)
+    try:
+        after, limit = get_page_parameters(request, decode_rank_cursor if settings.CANDIDATE_RANKING
+                                           else decode_cursor)
+    except InvalidPageParameter as e:
+        return JsonResponse({e.field: e.message}, status=status.HTTP_400_BAD_REQUEST)
+    if settings.CANDIDATE_RANKING:
+        page_ids, position = ranked_candidates(lover, after=after, limit=limit)
+        rows = {x['id']: x for x in lover_rows(Lover.objects.filter(id__in=page_ids))}
+        page = [rows[x] for x in page_ids if x in rows]
+        next_cursor = encode_rank_cursor(position) if position is not None else None
+    else:
+        page, next_cursor = paginate(lover_rows(get_candidates(lover, after=after, limit=limit)), limit)
+    response = JsonResponse(serialize_lover_rows(page), safe=False)
+    if next_cursor is not None:
+        response['X-Next-Cursor'] = next_cursor
+    return response
 
 
+@replica
 @api_view(['GET'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 # @permission_classes((IsAuthenticated,))
 def cities(request):
-    return JsonResponse(CitySerializer(City.objects.all(), many=True).data, safe=False)
+    return reference_response(request, 'cities', lambda: CitySerializer(City.objects.all(), many=True).data)
 
 
+@replica
 @api_view(['GET'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 # @permission_classes((IsAuthenticated,))
 def genders(request):
-    return JsonResponse(GenderSerializer(Gender.objects.all(), many=True).data, safe=False)
+    return reference_response(request, 'genders', lambda: GenderSerializer(Gender.objects.all(), many=True).data)
 
 
 @api_view(['GET', 'POST'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 @parser_classes([MultiPartParser, FormParser])
 def photos(request):
-    user = get_authenticated_user(request)
+    user = request.user
     lover = get_or_create_lover(user)
     if request.method == 'GET':
         photos = lover.photos.all()
@@ -291,18 +376,26 @@ def photos(request):
     elif request.method == 'POST':
         # lover.photos.all().delete()
         data = request.data
-        photo_serializer = PhotoSerializer(data=data)
+        photo_serializer = PhotoUploadSerializer(data=data)
         if photo_serializer.is_valid():
-            photo_serializer.save(lover=lover)
-            return Response(photo_serializer.data)
+            photo = photo_serializer.save(lover=lover)
+            enqueue_photo(photo)
+            return Response(PhotoSerializer(photo).data, status=status.HTTP_202_ACCEPTED)
         else:
             return Response(photo_serializer.errors, status=status.HTTP_418_IM_A_TEAPOT)
 
 
-@api_view(['DELETE'])
-@authentication_classes((TokenAuthentication,))
+@api_view(['GET', 'DELETE'])
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 def photo_id(request, photo_id):
+    if request.method == 'GET':
+        # lets the client poll the processing status of an upload
+        try:
+            photo = Photo.objects.get(pk=photo_id, lover__user=request.user)
+        except Photo.DoesNotExist:
+            return Response({"message": "photo not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(PhotoSerializer(photo).data)
     try:
         Photo.objects.get(pk=photo_id).delete()
     except Photo.DoesNotExist:
@@ -310,11 +403,64 @@ def photo_id(request, photo_id):
     return Response({"message": "photo deleted"}, status=status.HTTP_200_OK)
 
 
+@replica
 @api_view(['GET'])
-@authentication_classes((TokenAuthentication,))
+@authentication_classes((CachedTokenAuthentication,))
 @permission_classes((IsAuthenticated,))
 def matches(request):
-    user = get_authenticated_user(request)
+    user = request.user
     lover = get_or_create_lover(user)
-    response = [x for x in lover.likes.all().exclude(id=lover.id) if x in lover.likers.all()]
-    return JsonResponse(LoverSerializer(response, many=True).data, safe=False)
+    response = Lover.objects.filter(matched_by__lover=lover).order_by('id')
+    return StreamingJsonResponse(iter_lovers(response))
+
+
+def metrics(request):
+    if not settings.METRICS_TOKEN and not settings.METRICS_PUBLIC:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    if settings.METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''),
+                                                          'Bearer %s' % settings.METRICS_TOKEN):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(render_metrics(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# a year, the longest lifetime RFC 7234 recommends
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def media(request, path):
+    """
+    Serve a processed photo. Content addressed files never change and are
+    cached forever, the front web server streams the bytes when
+    MEDIA_SENDFILE is set. Staged uploads are never served.
+    """
+    if request.method not in ('GET', 'HEAD') or not path.startswith('photos/'):
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    if not os.path.isfile(full_path):
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    digest = content_digest(path)
+    if digest is not None:
+        etag = '"%s"' % digest
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+            return response
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    if digest is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        # photos stored before content addressing may be replaced under the same name
+        patch_cache_control(response, public=True, max_age=24 * 3600)
+    return response
@@ -2,6 +2,8 @@
 ASGI config for lovocco project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides the Django project, it serves the Server-Sent Events stream of the
+matches at /api/matches/stream (see backend.streams).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +11,19 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lovocco.settings')
 
-application = get_asgi_application()
+try:
+    from django.core.asgi import get_asgi_application
+except ImportError:
+    # Django < 3.0 has no ASGI handler, the API is then served by gunicorn and only the stream here
+    django.setup()
+    django_application = None
+else:
+    django_application = get_asgi_application()
+
+from backend.streams import MatchStream  # noqa: E402
+
+application = MatchStream(django_application)
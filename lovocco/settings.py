@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
-from decouple import config
+import tempfile
+from decouple import Csv, config
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -51,6 +52,8 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'backend.middleware.MetricsMiddleware',
+    'backend.routers.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -77,6 +80,9 @@ CORS_ALLOW_HEADERS = (
    'x-requested-with',
     'app-key',
 )
+CORS_EXPOSE_HEADERS = (
+    'x-next-cursor',
+)
 
 TEMPLATES = [
     {
@@ -108,10 +114,119 @@ DATABASES = {
         'USER': config('X_DB_USERNAME', default=''),
         'PASSWORD': config('X_DB_PASSWORD', default=''),
         'HOST': config('X_DB_HOST', default=''),
-        'PORT': config('X_DB_PORT', default='')
+        'PORT': config('X_DB_PORT', default=''),
+        # seconds a worker thread keeps its connection open, 0 closes it at the end of each request
+        'CONN_MAX_AGE': config('X_DB_CONN_MAX_AGE', default=0, cast=int),
     }
 }
 
+# Check at the start of each request that the connections kept open still work, see backend.signals, and
+# ping pooled connections at each checkout
+DB_HEALTH_CHECKS = config('X_DB_HEALTH_CHECKS', default=False, cast=bool)
+# Connection pool shared by the threads of a worker, used with the engines backend.db.backends.postgresql
+# and backend.db.backends.mysql. Leave CONN_MAX_AGE at 0 so that connections go back to the pool after
+# each request.
+DB_POOL_SIZE = config('X_DB_POOL_SIZE', default=10, cast=int)
+DB_POOL_TIMEOUT = config('X_DB_POOL_TIMEOUT', default=10, cast=int)
+# seconds a pooled connection may stay idle before it is pinged at checkout
+DB_POOL_PING_IDLE = config('X_DB_POOL_PING_IDLE', default=30, cast=int)
+
+# Read replicas, see backend.routers
+# Each replica takes the settings of the primary with its own host and/or name, e.g.
+# X_DB_REPLICA_HOSTS=db-replica-1,db-replica-2 or, with SQLite, X_DB_REPLICA_NAMES=replica.sqlite3
+
+DB_REPLICA_HOSTS = config('X_DB_REPLICA_HOSTS', default='', cast=Csv())
+DB_REPLICA_NAMES = config('X_DB_REPLICA_NAMES', default='', cast=Csv())
+for i in range(max(len(DB_REPLICA_HOSTS), len(DB_REPLICA_NAMES))):
+    DATABASES['replica%d' % i] = dict(
+        DATABASES['default'],
+        HOST=DB_REPLICA_HOSTS[i] if i < len(DB_REPLICA_HOSTS) else DATABASES['default']['HOST'],
+        NAME=DB_REPLICA_NAMES[i] if i < len(DB_REPLICA_NAMES) else DATABASES['default']['NAME'],
+        TEST={'MIRROR': 'default'},
+    )
+DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['backend.routers.ReplicaRouter']
+# Seconds during which a client that wrote reads from the primary
+DB_REPLICA_PIN_SECONDS = config('X_DB_REPLICA_PIN_SECONDS', default=5, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # The clients that wrote, shared by the workers so that every worker reads their writes from the primary
+    'replica-pins': {
+        'BACKEND': config('X_REPLICA_PIN_CACHE_BACKEND',
+                          default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('X_REPLICA_PIN_CACHE_LOCATION',
+                           default=os.path.join(tempfile.gettempdir(), 'lovocco-replica-pins')),
+        'OPTIONS': {'MAX_ENTRIES': config('X_REPLICA_PIN_CACHE_SIZE', default=10000, cast=int)},
+    },
+}
+
+
+# Candidate matching
+# When enabled, candidates are looked up in the process-local index of backend.matching
+
+MATCHING_USE_INDEX = config('X_MATCHING_USE_INDEX', default=False, cast=bool)
+MATCHING_INDEX_TTL = config('X_MATCHING_INDEX_TTL', default=300, cast=int)
+
+# Token authentication cache of backend.authentication
+# A deleted token may still be accepted by other worker processes for TOKEN_CACHE_TTL seconds
+
+TOKEN_CACHE_SIZE = config('X_TOKEN_CACHE_SIZE', default=10000, cast=int)
+TOKEN_CACHE_TTL = config('X_TOKEN_CACHE_TTL', default=60, cast=int)
+
+# Lifetime in seconds of the cached cities and genders, in workers and in clients
+
+REFERENCE_CACHE_TTL = config('X_REFERENCE_CACHE_TTL', default=3600, cast=int)
+
+# Request metrics served by api/metrics, see backend.metrics
+# With several gunicorn workers METRICS_DIR must be a directory shared by the workers of a host
+
+METRICS_DIR = config('X_METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('X_METRICS_FLUSH_INTERVAL', default=10, cast=int)
+# api/metrics requires the header 'Authorization: Bearer <METRICS_TOKEN>', and is disabled when no token is set
+# unless METRICS_PUBLIC is, in which case the route must be blocked at the proxy
+METRICS_TOKEN = config('X_METRICS_TOKEN', default='')
+METRICS_PUBLIC = config('X_METRICS_PUBLIC', default=False, cast=bool)
+
+# Match notifications pushed by the Server-Sent Events stream of lovocco.asgi, see backend.streams
+
+# The default broker reaches the streams of every process of this host, InProcessBroker only those of the
+# publishing process
+MATCH_EVENTS_BROKER = config('X_MATCH_EVENTS_BROKER', default='backend.events.UnixSocketBroker')
+MATCH_EVENTS_SOCKET_DIR = config('X_MATCH_EVENTS_SOCKET_DIR',
+                                 default=os.path.join(tempfile.gettempdir(), 'lovocco-events'))
+MATCH_STREAM_HEARTBEAT = config('X_MATCH_STREAM_HEARTBEAT', default=25, cast=int)
+MATCH_STREAM_QUEUE_SIZE = config('X_MATCH_STREAM_QUEUE_SIZE', default=100, cast=int)
+
+# Number of candidates returned per page of the deck
+
+DECK_PAGE_SIZE = config('X_DECK_PAGE_SIZE', default=20, cast=int)
+DECK_MAX_PAGE_SIZE = config('X_DECK_MAX_PAGE_SIZE', default=100, cast=int)
+# Nearby cities, see backend.geo
+CITY_GRID_DEGREES = config('X_CITY_GRID_DEGREES', default=0.5, cast=float)
+# Largest search radius, in kilometers, a lover may choose
+MAX_SEARCH_RADIUS = config('X_MAX_SEARCH_RADIUS', default=200, cast=int)
+# Rank the candidates by compatibility instead of returning them by id, see backend.ranking
+CANDIDATE_RANKING = config('X_CANDIDATE_RANKING', default=False, cast=bool)
+RANKING_MAX_CANDIDATES = config('X_RANKING_MAX_CANDIDATES', default=50000, cast=int)
+# Candidate ids cached per lover, see backend.matching.DeckCache, 0 disables the cache
+DECK_CACHE_SIZE = config('X_DECK_CACHE_SIZE', default=10000, cast=int)
+DECK_CACHE_TTL = config('X_DECK_CACHE_TTL', default=300, cast=int)
+# Largest number of swipes accepted by api/swipes
+SWIPE_BATCH_SIZE = config('X_SWIPE_BATCH_SIZE', default=200, cast=int)
+# Rows read and serialized at a time by the streamed lists (matches, admin exports)
+STREAM_CHUNK_SIZE = config('X_STREAM_CHUNK_SIZE', default=500, cast=int)
+
+# Write-behind swipes, see backend.swipes
+# Swipes are appended to PendingSwipe and moved to the likes/dislikes tables every SWIPE_FLUSH_INTERVAL
+# seconds by a thread of each worker, or by the flush_swipes command when the interval is 0
+
+SWIPE_BUFFER = config('X_SWIPE_BUFFER', default=False, cast=bool)
+SWIPE_FLUSH_INTERVAL = config('X_SWIPE_FLUSH_INTERVAL', default=5, cast=int)
+SWIPE_FLUSH_BATCH_SIZE = config('X_SWIPE_FLUSH_BATCH_SIZE', default=500, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -154,6 +269,16 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# Resized photos, see backend.images
+PHOTO_WEBP = config('X_PHOTO_WEBP', default=False, cast=bool)
+PHOTO_QUALITY = config('X_PHOTO_QUALITY', default=82, cast=int)
+# Threads processing the uploaded photos of a worker process, 0 processes them during the request
+PHOTO_WORKERS = config('X_PHOTO_WORKERS', default=2, cast=int)
+# How api media hands the photos to the front web server: '' streams them from the worker, 'x-accel-redirect'
+# (nginx, internal location MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache, lighttpd)
+MEDIA_SENDFILE = config('X_MEDIA_SENDFILE', default='')
+MEDIA_ACCEL_PREFIX = config('X_MEDIA_ACCEL_PREFIX', default='/protected-media/')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
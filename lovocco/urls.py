@@ -26,9 +26,12 @@ urlpatterns = [
     path('api/lovers/candidates', views.candidates),
     path('api/lovers/<int:lover_id>/like', views.like),
     path('api/lovers/<int:lover_id>/dislike', views.dislike),
+    path('api/swipes', views.batch_swipes),
     path('api/photos', views.photos),
     path('api/photos/<int:photo_id>', views.photo_id),
     path('api/matches', views.matches),
+    path('api/metrics', views.metrics),
+    path('media/<path:path>', views.media),
     # Authentication
     path('api/authenticate', obtain_auth_token),
     path('api/register', views.register_user)